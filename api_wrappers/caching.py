@@ -1,29 +1,275 @@
 import datetime
+import logging
+import threading
 import time
+from concurrent.futures import Future
 from functools import wraps
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import cachetools
+import cachetools.keys
+
+from api_wrappers.rate_limiting import Priority
+from api_wrappers.rate_limiting import TokenBucket
+from api_wrappers.sqlite_cache import SqliteCache
+
+
+class _InFlight:
+    """
+    a call that's in progress, which other callers with the same key can wait for instead of making the same call
+    """
+
+    def __init__(self):
+        self.future: Future = Future()
+        self.callers: int = 1
+
+
+def _join(in_flight: Dict[Hashable, _InFlight], key: Hashable) -> Tuple[_InFlight, bool]:
+    """
+    join the call in progress for this key, or start a new one (must hold the lock for `in_flight`)
+
+    :return: the call, and whether we're the one who has to make it
+    """
+    if key in in_flight:
+        call = in_flight[key]
+        call.callers += 1
+        return call, False
+
+    call = in_flight[key] = _InFlight()
+    return call, True
+
+
+def _lead(lock: threading.Lock,
+          in_flight: Dict[Hashable, _InFlight],
+          key: Hashable,
+          call: _InFlight,
+          compute: Callable[[], Any],
+          store: Callable[[Any], None],
+          ) -> Any:
+    """
+    make the call, store the result (while holding the lock), then share the result (or exception) with the others
+    """
+    try:
+        result = compute()
+    except BaseException as e:
+        with lock:
+            del in_flight[key]
+        call.future.set_exception(e)
+        raise
+
+    with lock:
+        store(result)
+        del in_flight[key]
+    call.future.set_result(result)
+    return result
+
+
+# every cached function, for monitoring
+_cached_functions: List[Callable] = []
 
 
 def cache_ttl(seconds: Union[int, float, datetime.timedelta],
-              maxsize: Optional[int] = None):
+              maxsize: Optional[int] = None,
+              disk: Optional[SqliteCache] = None):
+    """
+    thread-safe ttl cache, with single-flight calls:
+    if there's already a call in progress for the same args, we wait for it and share its result (or exception)
+    exceptions aren't cached
+
+    :param disk: if provided, results are also stored there, so they survive restarts and are shared across processes
+    """
     if isinstance(seconds, datetime.timedelta):
         seconds = seconds.total_seconds()
     assert isinstance(seconds, (int, float)), seconds
 
     def decorator(func):
+        namespace = f'{func.__module__}.{func.__qualname__}'
+        cache = cachetools.TTLCache(maxsize=maxsize, ttl=seconds)  # key -> (value, expiry unix timestamp)
+        in_flight: Dict[Hashable, _InFlight] = dict()
+        lock = threading.Lock()  # guards both `cache` and `in_flight`
+
+        def compute(key, args, kwargs) -> Tuple[Any, float]:
+            if disk is not None:
+                entry = disk.get(namespace, key)
+                if entry is not None:
+                    return entry[0], entry[1] + seconds
+
+            result = func(*args, **kwargs)
+            if disk is not None:
+                disk.set(namespace, key, result, seconds)
+            return result, time.time() + seconds
+
+        def store(key, entry):
+            try:
+                cache[key] = entry
+            except ValueError:
+                pass  # too large to cache
+
         @wraps(func)
-        @cachetools.cached(cachetools.TTLCache(maxsize=maxsize, ttl=seconds))
         def wrapper(*args, **kwargs):
-            return func(*args, **kwargs)
+            key = cachetools.keys.hashkey(*args, **kwargs)
+            with lock:
+                # an entry loaded from disk expires earlier than the in-memory cache thinks it does
+                if key in cache and cache[key][1] > time.time():
+                    return cache[key][0]
+
+                # if someone's already making this call, we wait for them
+                call, is_leader = _join(in_flight, key)
+
+            if not is_leader:
+                return call.future.result()[0]
+            return _lead(lock, in_flight, key, call,
+                         lambda: compute(key, args, kwargs),
+                         lambda entry: store(key, entry))[0]
 
+        def in_flight_counts() -> Dict[Hashable, int]:
+            """
+            for each call that's in progress, how many callers are waiting on it (including the one making the call)
+            """
+            with lock:
+                return {key: call.callers for key, call in in_flight.items()}
+
+        wrapper.cache = cache
+        wrapper.in_flight_counts = in_flight_counts
+        _cached_functions.append(wrapper)
         return wrapper
 
     return decorator
 
 
+def cache_swr(fresh_seconds: Union[int, float, datetime.timedelta],
+              max_age_seconds: Union[int, float, datetime.timedelta],
+              maxsize: int = 0xFF,
+              disk: Optional[SqliteCache] = None):
+    """
+    stale-while-revalidate cache, with single-flight calls (see `cache_ttl`)
+    * younger than `fresh_seconds`: return the cached value
+    * older than that: still return the cached value immediately, but refresh it in a background thread
+    * if the refresh fails (e.g. the api is down), keep returning the last known good value
+    * older than `max_age_seconds`: it's too old to use, so we block on a refresh (and raise if that fails)
+
+    use `func.last_updated(*args, **kwargs)` to find out how old the value you got is
+
+    :param disk: if provided, results are also stored there (until `max_age_seconds`),
+                 so they survive restarts and are shared across processes
+    """
+    if isinstance(fresh_seconds, datetime.timedelta):
+        fresh_seconds = fresh_seconds.total_seconds()
+    if isinstance(max_age_seconds, datetime.timedelta):
+        max_age_seconds = max_age_seconds.total_seconds()
+    assert isinstance(fresh_seconds, (int, float)), fresh_seconds
+    assert isinstance(max_age_seconds, (int, float)), max_age_seconds
+    assert 0 < fresh_seconds <= max_age_seconds, (fresh_seconds, max_age_seconds)
+
+    def decorator(func):
+        namespace = f'{func.__module__}.{func.__qualname__}'
+        cache = cachetools.LRUCache(maxsize=maxsize)  # key -> (value, unix timestamp)
+        in_flight: Dict[Hashable, _InFlight] = dict()
+        failed: Dict[Hashable, float] = dict()  # key -> unix timestamp of the last failed background refresh
+        lock = threading.Lock()  # guards `cache`, `in_flight`, and `failed`
+
+        def store(key, result):
+            cache[key] = (result, time.time())
+            failed.pop(key, None)
+
+        def compute(key, args, kwargs):
+            result = func(*args, **kwargs)
+            if disk is not None:
+                disk.set(namespace, key, result, max_age_seconds)
+            return result
+
+        def refresh_in_background(key, call, args, kwargs):
+            # noinspection PyBroadException
+            try:
+                with TokenBucket.priority(Priority.BACKGROUND):
+                    _lead(lock, in_flight, key, call,
+                          lambda: compute(key, args, kwargs),
+                          lambda result: store(key, result))
+            except Exception as e:
+                with lock:
+                    failed[key] = time.time()
+                logging.warning(f'CACHE_REFRESH_FAILED="{func.__module__}.{func.__qualname__}" ERROR="{e!r}"')
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = cachetools.keys.hashkey(*args, **kwargs)
+
+            # load from disk if we don't have it in memory (e.g. after a restart)
+            if disk is not None:
+                with lock:
+                    in_memory = key in cache
+                if not in_memory:
+                    entry = disk.get(namespace, key)
+                    if entry is not None:
+                        with lock:
+                            cache.setdefault(key, entry)
+
+            with lock:
+                if key in cache:
+                    value, timestamp = cache[key]
+                    age = time.time() - timestamp
+                    if age < max_age_seconds:
+                        # don't retry a failed refresh until `fresh_seconds` later, so we don't hammer a failing api
+                        if age >= fresh_seconds and key not in in_flight \
+                                and time.time() - failed.get(key, 0) >= fresh_seconds:
+                            call, _ = _join(in_flight, key)
+                            threading.Thread(target=refresh_in_background,
+                                             args=(key, call, args, kwargs),
+                                             name=f'refresh-{func.__qualname__}',
+                                             daemon=True).start()
+                        return value
+
+                # missing or too old to use, so we have to wait
+                call, is_leader = _join(in_flight, key)
+
+            if not is_leader:
+                return call.future.result()
+            return _lead(lock, in_flight, key, call,
+                         lambda: compute(key, args, kwargs),
+                         lambda result: store(key, result))
+
+        def last_updated(*args, **kwargs) -> Optional[datetime.datetime]:
+            """
+            when the cached value for these args was computed, or None if there isn't one
+            """
+            with lock:
+                entry = cache.get(cachetools.keys.hashkey(*args, **kwargs))
+            if entry is None:
+                return None
+            return datetime.datetime.fromtimestamp(entry[1])
+
+        def in_flight_counts() -> Dict[Hashable, int]:
+            with lock:
+                return {key: call.callers for key, call in in_flight.items()}
+
+        wrapper.cache = cache
+        wrapper.last_updated = last_updated
+        wrapper.in_flight_counts = in_flight_counts
+        _cached_functions.append(wrapper)
+        return wrapper
+
+    return decorator
+
+
+def in_flight_counts() -> Dict[str, Dict[Hashable, int]]:
+    """
+    in-progress calls for every cached function that has any, see `cache_ttl`
+    """
+    out = dict()
+    for func in _cached_functions:
+        counts = func.in_flight_counts()
+        if counts:
+            out[f'{func.__module__}.{func.__qualname__}'] = counts
+    return out
+
+
 cache_1s = cache_ttl(1, 0xFF)
 cache_5s = cache_ttl(5, 0xFF)
 cache_1m = cache_ttl(60, 0xFF)
@@ -40,3 +286,25 @@ if __name__ == '__main__':
     for _ in range(100):
         print(now())
         time.sleep(0.25)
+
+    # 100 concurrent callers should make only 1 call
+    n_calls = 0
+
+
+    @cache_5s
+    def slow(x):
+        global n_calls
+        n_calls += 1
+        time.sleep(1)
+        return x
+
+
+    threads = [threading.Thread(target=slow, args=(1,)) for _ in range(100)]
+    t = time.time()
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    print(in_flight_counts())
+    for thread in threads:
+        thread.join()
+    print('100 concurrent calls', time.time() - t, 'underlying calls', n_calls)
@@ -10,9 +10,9 @@ from typing import Union
 from uuid import UUID
 
 import pandas as pd
-import requests
 import tabulate
 
+from api_wrappers import transport
 from api_wrappers.data_gov_sg.datatypes import DataStoreResult
 from api_wrappers.data_gov_sg.datatypes import Dataset
 from api_wrappers.data_gov_sg.datatypes import Resource
@@ -27,11 +27,12 @@ def get_resource(resource_id: Union[str, UUID]) -> Resource:
     :param resource_id: the id of the resource
     :return:
     """
-    r = requests.get('https://data.gov.sg/api/action/resource_show',
-                     headers=DGS_HEADERS,
-                     params={
-                         'id': resource_id,
-                     }, verify=False)
+    r = transport.get('https://data.gov.sg/api/action/resource_show',
+                      headers=DGS_HEADERS,
+                      params={
+                          'id': resource_id,
+                      },
+                      verify=transport.SG_GOV_VERIFY_TLS)
     data = r.json()
     if not data['success']:
         raise IndexError(resource_id)
@@ -44,11 +45,12 @@ def get_dataset(dataset_id: Union[str, UUID]) -> Dataset:
 
     :param dataset_id: the id or name of the dataset
     """
-    r = requests.get('https://data.gov.sg/api/action/package_show',
-                     headers=DGS_HEADERS,
-                     params={
-                         'id': dataset_id,
-                     }, verify=False)
+    r = transport.get('https://data.gov.sg/api/action/package_show',
+                      headers=DGS_HEADERS,
+                      params={
+                          'id': dataset_id,
+                      },
+                      verify=transport.SG_GOV_VERIFY_TLS)
     data = r.json()
     if not data['success']:
         raise IndexError(dataset_id)
@@ -114,9 +116,10 @@ def get_datastore(resource_id: Union[str, UUID],
     if sort is not None:
         params['sort'] = sort
 
-    r = requests.get('https://data.gov.sg/api/action/datastore_search',
-                     headers=DGS_HEADERS,
-                     params=params, verify=False)
+    r = transport.get('https://data.gov.sg/api/action/datastore_search',
+                      headers=DGS_HEADERS,
+                      params=params,
+                      verify=transport.SG_GOV_VERIFY_TLS)
     if r.status_code != 200:
         raise IndexError(resource_id, r.status_code, r.content)
     data = r.json()
@@ -126,9 +129,10 @@ def get_datastore(resource_id: Union[str, UUID],
     # there's more data to load
     if limit is None and data['result']['total'] > data['result']['limit']:
         params['limit'] = data['result']['total']
-        r = requests.get('https://data.gov.sg/api/action/datastore_search',
-                         headers=DGS_HEADERS,
-                         params=params, verify=False)
+        r = transport.get('https://data.gov.sg/api/action/datastore_search',
+                          headers=DGS_HEADERS,
+                          params=params,
+                          verify=transport.SG_GOV_VERIFY_TLS)
         data = r.json()
 
     # create a df
@@ -11,7 +11,8 @@ from typing import Union
 from uuid import UUID
 
 import pandas as pd
-import requests
+
+from api_wrappers import transport
 
 
 class ResourceFormat(Enum):
@@ -67,7 +68,7 @@ class Resource:
             raise FileExistsError(path)
 
         # get file
-        r = requests.get(self.url, verify=False)
+        r = transport.get(self.url, verify=transport.SG_GOV_VERIFY_TLS)
         if r.status_code != 200:
             raise RuntimeError(self.url)
 
@@ -3,8 +3,7 @@ import json
 import time
 from pathlib import Path
 
-import requests
-
+from api_wrappers import transport
 from config import DGS_HEADERS
 
 data_path = Path(f'data/live-weather/data--{datetime.datetime.now().strftime("%Y-%m-%d--%H-%M-%S")}.jsonl')
@@ -27,9 +26,9 @@ if __name__ == '__main__':
         e = None
         for _attempt in range(5):
             try:
-                r = requests.get('https://api.data.gov.sg/v1/environment/air-temperature',
-                                 headers=DGS_HEADERS,
-                                 params={'date': _date.strftime("%Y-%m-%d")})
+                r = transport.get('https://api.data.gov.sg/v1/environment/air-temperature',
+                                  headers=DGS_HEADERS,
+                                  params={'date': _date.strftime("%Y-%m-%d")})
                 assert r.status_code == 200
                 break
             except Exception as e:
@@ -5,9 +5,9 @@ from typing import Dict
 from typing import List
 from typing import Tuple
 
-import requests
-
+from api_wrappers import transport
 from api_wrappers.caching import cache_1m
+from api_wrappers.caching import cache_swr
 from api_wrappers.location import Location
 from config import DGS_HEADERS
 
@@ -94,7 +94,8 @@ class FourDayForecast:
     # last_update: datetime.datetime
 
 
-@cache_1m
+# the forecast is updated every 30 mins, and is only valid for 2 hours
+@cache_swr(60, 2 * 60 * 60)
 def weather_2h() -> List[Forecast]:
     """
     https://beta.data.gov.sg/datasets/d_91ffc58263cff535910c16a4166ccbc3/view
@@ -106,11 +107,12 @@ def weather_2h() -> List[Forecast]:
     Use the date parameter to retrieve all of the forecasts issued for that day
     """
     fmt = '%Y-%m-%dT%H:%M:%S+08:00'
-    r = requests.get('https://api.data.gov.sg/v1/environment/2-hour-weather-forecast',
-                     headers=DGS_HEADERS,
-                     # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
-                     # params={'date': date.strftime('%Y-%m-%d')},
-                     verify=False)
+    r = transport.get('https://api.data.gov.sg/v1/environment/2-hour-weather-forecast',
+                      headers=DGS_HEADERS,
+                      verify=transport.SG_GOV_VERIFY_TLS,
+                      # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
+                      # params={'date': date.strftime('%Y-%m-%d')},
+                      )
     data = r.json()
     area_forecasts = {item['area']: item['forecast'] for item in data['items'][0]['forecasts']}
     return [Forecast(latitude=item['label_location']['latitude'],
@@ -123,7 +125,8 @@ def weather_2h() -> List[Forecast]:
                      ) for item in data['area_metadata']]
 
 
-@cache_1m
+# updated a few times a day
+@cache_swr(60, 12 * 60 * 60)
 def weather_24h() -> List[Forecast]:
     """
     https://beta.data.gov.sg/datasets/d_50d2bbe678607d78d74a0fe6e8b5b6dd/view
@@ -134,11 +137,12 @@ def weather_24h() -> List[Forecast]:
     Use the date parameter to retrieve all of the forecasts issued for that day
     """
     fmt = '%Y-%m-%dT%H:%M:%S+08:00'
-    r = requests.get('https://api.data.gov.sg/v1/environment/24-hour-weather-forecast',
-                     headers=DGS_HEADERS,
-                     # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
-                     # params={'date': date.strftime('%Y-%m-%d')},
-                     verify=False)
+    r = transport.get('https://api.data.gov.sg/v1/environment/24-hour-weather-forecast',
+                      headers=DGS_HEADERS,
+                      verify=transport.SG_GOV_VERIFY_TLS,
+                      # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
+                      # params={'date': date.strftime('%Y-%m-%d')},
+                      )
     data = r.json()
     return [Forecast(latitude=region_metadata[region_name.title()].latitude,
                      longitude=region_metadata[region_name.title()].longitude,
@@ -159,6 +163,8 @@ def weather_24h_grouped() -> Dict[Tuple[datetime.datetime, datetime.datetime], L
     return out
 
 
+# updated twice a day
+@cache_swr(60, 24 * 60 * 60)
 def weather_4d() -> List[FourDayForecast]:
     """
     Updated twice a day from NEA
@@ -170,11 +176,12 @@ def weather_4d() -> List[FourDayForecast]:
     out = []
 
     # first we get today's current forecast
-    r = requests.get('https://api.data.gov.sg/v1/environment/24-hour-weather-forecast',
-                     headers=DGS_HEADERS,
-                     # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
-                     # params={'date': date.strftime('%Y-%m-%d')},
-                     verify=False)
+    r = transport.get('https://api.data.gov.sg/v1/environment/24-hour-weather-forecast',
+                      headers=DGS_HEADERS,
+                      verify=transport.SG_GOV_VERIFY_TLS,
+                      # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
+                      # params={'date': date.strftime('%Y-%m-%d')},
+                      )
     data = r.json()
     out.append(FourDayForecast(date=datetime.datetime.strptime(data['items'][0]['timestamp'], fmt).date(),
                                forecast=data['items'][0]['general']['forecast'].rstrip('.'),
@@ -189,11 +196,12 @@ def weather_4d() -> List[FourDayForecast]:
                                ))
 
     # then we get the forecast for the next 4 days
-    r = requests.get('https://api.data.gov.sg/v1/environment/4-day-weather-forecast',
-                     headers=DGS_HEADERS,
-                     # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
-                     # params={'date': date.strftime('%Y-%m-%d')},
-                     verify=False)
+    r = transport.get('https://api.data.gov.sg/v1/environment/4-day-weather-forecast',
+                      headers=DGS_HEADERS,
+                      verify=transport.SG_GOV_VERIFY_TLS,
+                      # params={'date_time': dt.strftime('%Y-%m-%dT%H:%M:%S')} if dt else None,
+                      # params={'date': date.strftime('%Y-%m-%d')},
+                      )
     data = r.json()
     for forecast in data['items'][0]['forecasts']:
         out.append(FourDayForecast(date=datetime.datetime.strptime(forecast['date'], '%Y-%m-%d').date(),
@@ -0,0 +1,264 @@
+"""
+an offline gazetteer of singapore postal codes, since each postal code (almost) always maps to the same building
+filled in from every onemap result we see, and can be bulk loaded from a csv with onemap's column names
+stored in sqlite, keyed by the integer postal code, so it's shared by every process and survives restarts
+
+also full-text searchable (by building name, block, and road) via an fts5 index that's kept in sync by triggers
+"""
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Union
+
+import pandas as pd
+
+from tokenizer import unicode_tokenize
+
+# same names as the `OneMapResult` fields, so a row can be turned back into one with `OneMapResult(**row)`
+FIELDS = ('block_no', 'road_name', 'building_name', 'zipcode', 'latitude', 'longitude', 'svy21_x', 'svy21_y',
+          '_address')
+
+# onemap's names for the same fields (as in the search api response)
+ONEMAP_COLUMNS = {
+    'BLK_NO':    'block_no',
+    'ROAD_NAME': 'road_name',
+    'BUILDING':  'building_name',
+    'POSTAL':    'zipcode',
+    'LATITUDE':  'latitude',
+    'LONGITUDE': 'longitude',
+    'X':         'svy21_x',
+    'Y':         'svy21_y',
+    'ADDRESS':   '_address',
+}
+
+
+class PostalCodeGazetteer:
+    """
+    postal code -> building (address and coordinates)
+    thread-safe (each thread gets its own connection), and multi-process safe (via sqlite's locking)
+    errors are logged and treated as a miss, since we can always ask onemap instead
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        :param path: the database is created on first use
+        """
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self._local, 'connection', None) is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)  # autocommit
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS postal_codes ('
+                               '    postal_code INTEGER PRIMARY KEY,'
+                               '    block_no TEXT NOT NULL,'
+                               '    road_name TEXT NOT NULL,'
+                               '    building_name TEXT NOT NULL,'
+                               '    latitude REAL NOT NULL,'
+                               '    longitude REAL NOT NULL,'
+                               '    svy21_x REAL,'
+                               '    svy21_y REAL,'
+                               '    address TEXT,'
+                               '    updated REAL NOT NULL'
+                               ')')
+
+            # the full-text index reads its content from `postal_codes`, so only the index itself is stored
+            # unicode61 lowercases like `tokenizer.unicode_tokenize`, and also keeps diacritics
+            # `INSERT OR REPLACE` only fires the delete trigger if recursive triggers are on
+            connection.execute('PRAGMA recursive_triggers = ON')
+            has_index = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'postal_codes_fts'").fetchone()
+            connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS postal_codes_fts USING fts5('
+                               '    building_name, block_no, road_name,'
+                               "    content = 'postal_codes', content_rowid = 'postal_code',"
+                               "    tokenize = 'unicode61 remove_diacritics 0'"
+                               ')')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS postal_codes_ai AFTER INSERT ON postal_codes BEGIN'
+                               '    INSERT INTO postal_codes_fts (rowid, building_name, block_no, road_name)'
+                               '    VALUES (new.postal_code, new.building_name, new.block_no, new.road_name);'
+                               'END')
+            connection.execute('CREATE TRIGGER IF NOT EXISTS postal_codes_ad AFTER DELETE ON postal_codes BEGIN'
+                               '    INSERT INTO postal_codes_fts (postal_codes_fts, rowid, building_name, block_no, '
+                               '                                  road_name)'
+                               "    VALUES ('delete', old.postal_code, old.building_name, old.block_no, old.road_name);"
+                               'END')
+            if has_index is None:
+                connection.execute("INSERT INTO postal_codes_fts (postal_codes_fts) VALUES ('rebuild')")
+            self._local.connection = connection
+        return self._local.connection
+
+    @staticmethod
+    def _row(block_no, road_name, building_name, zipcode, latitude, longitude, svy21_x, svy21_y, address) \
+            -> Optional[tuple]:
+        """
+        returns None if there's no valid postal code
+        """
+        zipcode = str(zipcode).strip()
+        if len(zipcode) != 6 or not zipcode.isdigit():
+            return None
+        return (int(zipcode),
+                block_no,
+                road_name,
+                building_name,
+                float(latitude),
+                float(longitude),
+                None if pd.isna(svy21_x) else float(svy21_x),
+                None if pd.isna(svy21_y) else float(svy21_y),
+                None if pd.isna(address) else address,
+                time.time(),
+                )
+
+    def _add_rows(self, rows: Iterable[tuple], replace: bool) -> int:
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        connection = None
+        try:
+            rows = [row for row in rows if row is not None]  # inside the try, since bad values raise here
+            if not rows:
+                return 0
+            connection = self._connection()
+            before = connection.total_changes
+            connection.execute('BEGIN')
+            connection.executemany(f'{verb} INTO postal_codes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('COMMIT')
+            return connection.total_changes - before
+
+        except Exception as e:
+            # otherwise this thread's connection stays in the transaction, holding the write lock
+            if connection is not None and connection.in_transaction:
+                connection.execute('ROLLBACK')
+            logging.warning(f'GAZETTEER_ADD_FAILED ERROR="{e!r}"')
+            return 0
+
+    def add_many(self, results: Iterable[Any], replace: bool = False) -> int:
+        """
+        :param results: `OneMapResult`s (or anything with the same attributes), those without a postal code are skipped
+        :param replace: overwrite existing postal codes (by default, the first result we saw is kept)
+        :return: how many were added
+        """
+        return self._add_rows((self._row(*(getattr(result, field, None) for field in FIELDS))
+                               for result in results), replace)
+
+    def add(self, result: Any, replace: bool = False) -> bool:
+        return self.add_many([result], replace=replace) > 0
+
+    def get(self, postal_code: Union[int, str]) -> Optional[Dict[str, Any]]:
+        """
+        :return: the fields of a `OneMapResult`, or None if we haven't seen this postal code
+        """
+        try:
+            row = self._connection().execute('SELECT block_no, road_name, building_name, postal_code, '
+                                              'latitude, longitude, svy21_x, svy21_y, address '
+                                              'FROM postal_codes WHERE postal_code = ?',
+                                              (int(postal_code),)).fetchone()
+        except Exception as e:
+            logging.warning(f'GAZETTEER_GET_FAILED ERROR="{e!r}"')
+            return None
+
+        if row is None:
+            return None
+        out = dict(zip(FIELDS, row))
+        out['zipcode'] = f'{row[3]:06d}'
+        return out
+
+    def search(self, query: str, limit: int = 25) -> List[Dict[str, Any]]:
+        """
+        full-text search, every word in the query must match (in any order), best matches first
+        building names are weighted highest, since that's what people usually search for
+
+        :return: the fields of a `OneMapResult` for each match, like `get`
+        """
+        # quote every word, so punctuation in the query can't be parsed as fts5 syntax
+        words = [word.replace('"', '""') for word in unicode_tokenize(query.casefold(), words_only=True)]
+        if not words:
+            return []
+
+        try:
+            rows = self._connection().execute('SELECT p.block_no, p.road_name, p.building_name, p.postal_code, '
+                                              '       p.latitude, p.longitude, p.svy21_x, p.svy21_y, p.address '
+                                              'FROM postal_codes_fts f JOIN postal_codes p '
+                                              '    ON p.postal_code = f.rowid '
+                                              'WHERE postal_codes_fts MATCH ? '
+                                              'ORDER BY bm25(postal_codes_fts, 4.0, 1.0, 2.0) '
+                                              'LIMIT ?',
+                                              (' '.join(f'"{word}"' for word in words), limit)).fetchall()
+        except Exception as e:
+            logging.warning(f'GAZETTEER_SEARCH_FAILED QUERY="{query}" ERROR="{e!r}"')
+            return []
+
+        out = []
+        for row in rows:
+            result = dict(zip(FIELDS, row))
+            result['zipcode'] = f'{row[3]:06d}'
+            out.append(result)
+        return out
+
+    def load_csv(self, path: Union[str, Path], replace: bool = False) -> int:
+        """
+        bulk load from a csv of onemap search results (with onemap's column names, see `ONEMAP_COLUMNS`)
+        """
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        df = df.rename(columns=ONEMAP_COLUMNS)
+        missing = set(FIELDS) - set(df.columns) - {'svy21_x', 'svy21_y', '_address'}
+        if missing:
+            raise ValueError(f'missing columns: {sorted(missing)}')
+        for column in ('svy21_x', 'svy21_y', '_address'):
+            if column not in df.columns:
+                df[column] = None
+            df[column] = df[column].replace('', None)  # these are optional
+        df['zipcode'] = df['zipcode'].str.strip().str.zfill(6)
+        rows = df[list(FIELDS)].itertuples(index=False, name=None)
+        n_added = self._add_rows((self._row(*values) for values in rows), replace)
+        logging.info(f'GAZETTEER_LOADED={n_added} PATH="{path}"')
+        return n_added
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM postal_codes').fetchone()[0]
+
+    def __contains__(self, postal_code: Union[int, str]) -> bool:
+        return self.get(postal_code) is not None
+
+
+postal_codes = PostalCodeGazetteer('data/postal-codes.sqlite3')
+
+if __name__ == '__main__':
+    import sys
+    import tempfile
+    from types import SimpleNamespace
+
+    # bulk load, e.g. `python -m api_wrappers.gazetteer postal-codes.csv`
+    for csv_path in sys.argv[1:]:
+        print(csv_path, postal_codes.load_csv(csv_path), len(postal_codes))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        gazetteer = PostalCodeGazetteer(Path(temp_dir) / 'test.sqlite3')
+
+        t = time.time()
+        gazetteer.add_many(SimpleNamespace(block_no=str(i),
+                                           road_name='SOME ROAD',
+                                           building_name=f'BUILDING {i}',
+                                           zipcode=f'{i:06d}',
+                                           latitude=1.3,
+                                           longitude=103.8,
+                                           svy21_x=1.0,
+                                           svy21_y=2.0,
+                                           ) for i in range(10000, 100000))
+        print('add x90000', time.time() - t, len(gazetteer))
+
+        t = time.time()
+        for i in range(10000, 100000):
+            assert gazetteer.get(i)['building_name'] == f'BUILDING {i}'
+        print('get x90000', time.time() - t)
+
+        t = time.time()
+        for i in range(10000, 11000):
+            assert gazetteer.search(f'building {i}')[0]['zipcode'] == f'{i:06d}'
+        print('search x1000', time.time() - t)
@@ -1,20 +1,117 @@
 import math
+import threading
 import time
 import warnings
 from dataclasses import dataclass
 from functools import lru_cache
+from pathlib import Path
 from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
+import cachetools
+import numpy as np
+from geographiclib.constants import Constants
 from geographiclib.geodesic import Geodesic
+from scipy.spatial import cKDTree
 
+from api_wrappers.polygons import PreparedPolygon
+
+try:
+    # optional, about 60x faster, but needs the C++ geographiclib to be installed before pip can build it
+    # see https://pypi.org/project/geographiclib-cython-bindings/
+    # noinspection PyPackageRequirements
+    from geographiclib_cython import Geodesic as CythonGeodesic
+except ImportError:
+    CythonGeodesic = None
+
+# vincenty backends, all of which return a dict containing (at least) 's12' and 'azi1'
 # noinspection PyUnresolvedReferences
-WGS84 = Geodesic.WGS84
+VINCENTY_BACKENDS = {'python': Geodesic.WGS84}
+if CythonGeodesic is not None:
+    VINCENTY_BACKENDS['cython'] = CythonGeodesic.WGS84
+
+# use the fastest backend available
+WGS84 = VINCENTY_BACKENDS.get('cython', VINCENTY_BACKENDS['python'])
+
+# the approximate (spherical or flat) distances below are within this fraction of vincenty anywhere in singapore
+# (haversine is within 0.6% anywhere on earth, equirectangular is much worse near the poles)
+APPROXIMATE_DISTANCE_ERROR = 0.01
+
+# mean earth radius, used by the approximate distances
+EARTH_RADIUS = 6371008.8  # meters
+
+SINGAPORE_BOUNDARY_PATH = Path('data/singapore-boundary/singapore-boundary.geojson')
+
+
+class GeodesicCache:
+    """
+    vincenty results for pairs of points, with coordinates rounded to some precision (1e-5 degrees is about 1 meter)
+    so that repeated lookups around the same place are served from memory even if the floats are not exactly equal
+
+    the geodesic is computed between the rounded points, so results are consistent regardless of lookup order,
+    but are only accurate to within `max_error` meters (use `exact=True` for threshold checks)
+    only the distance and direction are kept, as a tuple of 2 floats instead of geographiclib's dict of 8 floats
+    """
+
+    def __init__(self, precision: float = 1e-5, maxsize: int = 0xFFFF):
+        if precision <= 0:
+            raise ValueError(precision)
+        self.precision = precision
+
+        # each endpoint moves at most half a step in both latitude and longitude (~111.7km per degree, at most)
+        self.max_error = 2 * math.hypot(precision / 2, precision / 2) * 111700  # meters
+
+        self._cache = cachetools.LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def inverse(self, lat1: float, lon1: float, lat2: float, lon2: float, exact: bool = False) -> Tuple[float, float]:
+        """
+        :param exact: skip the cache and compute the geodesic between the unrounded points
+        :return: (distance in meters, direction in degrees clockwise from North)
+        """
+        if exact:
+            geodesic = WGS84.Inverse(lat1, lon1, lat2, lon2)
+            return geodesic['s12'], geodesic['azi1']
 
+        key = (round(lat1 / self.precision), round(lon1 / self.precision),
+               round(lat2 / self.precision), round(lon2 / self.precision))
 
-@lru_cache(maxsize=0xFFFF)
-def wgs84_inverse_cache(lat1, lon1, lat2, lon2):
-    return WGS84.Inverse(lat1, lon1, lat2, lon2)
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        # compute outside the lock, worst case two threads compute the same thing
+        geodesic = WGS84.Inverse(*(x * self.precision for x in key))
+        result = (geodesic['s12'], geodesic['azi1'])
+        with self._lock:
+            self._cache[key] = result
+        return result
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# used by `Location.distance` and `Location.direction`
+geodesic_cache = GeodesicCache()
 
 
 @dataclass  # (unsafe_hash=True, frozen=True)
@@ -40,16 +137,17 @@ class Location:
         if self.latitude == self.longitude == 0.0:
             warnings.warn('Location at (0.0, 0.0) might be NULL')
 
-    def distance(self, other: 'Location') -> float:
+    def distance(self, other: 'Location', exact: bool = False) -> float:
         """
         from this point, how far away is the other point?
-        uses vincenty formula
+        uses vincenty formula (accurate to about a meter, see `GeodesicCache`)
 
+        :param exact: don't round the coordinates, use this when comparing against a threshold of a few meters
         :return: positive distance in meters
         """
         if not isinstance(other, Location):
             raise TypeError(other)
-        return wgs84_inverse_cache(self.latitude, self.longitude, other.latitude, other.longitude)['s12']
+        return geodesic_cache.inverse(self.latitude, self.longitude, other.latitude, other.longitude, exact=exact)[0]
 
     def direction(self, other: 'Location') -> float:
         """
@@ -60,18 +158,38 @@ class Location:
         """
         if not isinstance(other, Location):
             raise TypeError(other)
-        return wgs84_inverse_cache(self.latitude, self.longitude, other.latitude, other.longitude)['azi1']
+        return geodesic_cache.inverse(self.latitude, self.longitude, other.latitude, other.longitude)[1]
+
+    def distances_to(self,
+                     others: Union[Iterable['Location'], 'LocationIndex'],
+                     method: str = 'haversine',
+                     ) -> np.ndarray:
+        """
+        approximate distances from this point to each of a bunch of other Locations, all at once
+        use `distance` (vincenty) instead if you need to be exact
+
+        :param method: 'haversine' or 'equirectangular'
+        :return: array of positive distances in meters, in the same order as `others`
+        """
+        latitudes, longitudes = _coordinates(others)
+        return _APPROXIMATE_DISTANCES[method](self.latitude, self.longitude, latitudes, longitudes)
 
-    def nearest(self, others: Iterable['Location']) -> 'Location':
+    def nearest(self, others: Union[Iterable['Location'], 'LocationIndex']) -> 'Location':
         """
         find the nearest among a bunch of other Locations
+        if `others` is a prebuilt LocationIndex, this uses the index instead of checking every location
         """
-        return min(others, key=lambda x: self.distance(x))
+        if isinstance(others, LocationIndex):
+            if not len(others):
+                raise ValueError(others)
+            return others.k_nearest(self, 1)[0]
+        return self.k_nearest(others, 1)[0]
 
-    def k_nearest(self, others: Iterable['Location'], k: int) -> List['Location']:
+    def k_nearest(self, others: Union[Iterable['Location'], 'LocationIndex'], k: int) -> List['Location']:
         """
         find the k-nearest among a bunch of other Locations
         if len(others) < k, throws an error
+        if `others` is a prebuilt LocationIndex, this uses the index instead of sorting every location
 
         assuming len(others) < 1000, it's not worth the code to use heapq
         """
@@ -81,15 +199,29 @@ class Location:
         if k == 0:
             raise ValueError(k)
 
+        # use the index if we have one
+        if isinstance(others, LocationIndex):
+            return others.k_nearest(self, k)
+
         # return all sorted if k is negative
-        out = sorted(others, key=lambda x: self.distance(x))
+        others = list(others)
         if k < 0:
-            return out
+            return sorted(others, key=lambda x: self.distance(x))
 
         # otherwise return top k
-        if len(out) < k:
+        if len(others) < k:
             raise ValueError(others)
-        return out[:k]
+
+        # the k nearest by haversine give an upper bound on the vincenty distance to the true k-th nearest
+        distances = self.distances_to(others)
+        max_distance = max(self.distance(others[idx]) for idx in np.argpartition(distances, k - 1)[:k])
+
+        # anything within that vincenty distance must be within a slightly larger haversine distance
+        # so only those need vincenty, and they're sorted in the original order so ties are broken the same way
+        # (the cached vincenty distances are rounded, so we need to allow for that too)
+        max_distance += geodesic_cache.max_error
+        idxs = np.flatnonzero(distances <= max_distance / (1 - APPROXIMATE_DISTANCE_ERROR))
+        return sorted((others[idx] for idx in idxs), key=lambda x: self.distance(x))[:k]
 
     def within_bounding_box(self, lat_1: float, lon_1: float, lat_2: float, lon_2: float) -> bool:
         # normalize bounding box
@@ -102,15 +234,305 @@ class Location:
 
     def within_singapore(self) -> bool:
         """
-        these magic numbers were created by clicking around the Singapore shape in Google Maps and rounding off
-        similar to (but not based on) SVY21 bounds: 1.1200, 103.6200, 1.4600, 104.1600
-        includes Tekong island, but does NOT include Pedra Branca or the tiny islands south of Semakau
-        also includes a bit of Johor, but close enough
+        point-in-polygon test against the Asia/Singapore timezone boundary (see `singapore_boundary`)
+        includes territorial waters, Tekong, and Pedra Branca, but not Johor
+        """
+        return singapore_boundary().contains(self.longitude, self.latitude)
+
+
+@lru_cache(maxsize=1)
+def singapore_boundary() -> PreparedPolygon:
+    """
+    loaded (and prepared) once, on first use
+    """
+    return PreparedPolygon.from_geojson(SINGAPORE_BOUNDARY_PATH)
+
+
+def within_singapore(latitudes, longitudes) -> np.ndarray:
+    """
+    vectorized `Location.within_singapore`
+    """
+    return singapore_boundary().contains_many(longitudes, latitudes)
+
+
+def _coordinates(locations: Union[Iterable[Location], 'LocationIndex']) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    latitudes and longitudes of a bunch of Locations as two arrays
+    """
+    if isinstance(locations, LocationIndex):
+        return locations.latitudes, locations.longitudes
+
+    locations = list(locations)
+    for location in locations:
+        if not isinstance(location, Location):
+            raise TypeError(location)
+    return (np.array([location.latitude for location in locations], dtype=float),
+            np.array([location.longitude for location in locations], dtype=float))
+
+
+def _ecef(latitudes, longitudes) -> np.ndarray:
+    """
+    convert WGS84 lat/lon (at zero height) to earth-centered earth-fixed (x, y, z) coordinates in meters
+    the straight-line (chord) distance between two ECEF points is never longer than the geodesic between them
+    """
+    a = Constants.WGS84_a
+    e2 = Constants.WGS84_f * (2 - Constants.WGS84_f)
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    n = a / np.sqrt(1 - e2 * np.sin(lat) ** 2)  # prime vertical radius of curvature
+    return np.column_stack([n * np.cos(lat) * np.cos(lon),
+                            n * np.cos(lat) * np.sin(lon),
+                            n * (1 - e2) * np.sin(lat)])
+
+
+def _ecef_point(location: Location) -> Tuple[float, float, float]:
+    """
+    same as `_ecef`, for a single point, without the numpy overhead
+    """
+    a = Constants.WGS84_a
+    e2 = Constants.WGS84_f * (2 - Constants.WGS84_f)
+    lat = math.radians(location.latitude)
+    lon = math.radians(location.longitude)
+    n = a / math.sqrt(1 - e2 * math.sin(lat) ** 2)
+    return (n * math.cos(lat) * math.cos(lon),
+            n * math.cos(lat) * math.sin(lon),
+            n * (1 - e2) * math.sin(lat))
+
+
+class LocationIndex:
+    """
+    a static spatial index over some Locations (e.g. all the hawker centres), built once per dataset load
+
+    the kd-tree is over ECEF coordinates, so the tree distance is the chord through the earth
+    since the chord is a lower bound for the geodesic, the tree is only used to pick candidates
+    and the results are still exact, because vincenty is used to rank the final candidates
+    """
+
+    def __init__(self, locations: Iterable[Location]):
+        self.locations: List[Location] = list(locations)
+        for location in self.locations:
+            if not isinstance(location, Location):
+                raise TypeError(location)
+
+        self.latitudes = np.array([location.latitude for location in self.locations], dtype=float)
+        self.longitudes = np.array([location.longitude for location in self.locations], dtype=float)
+
+        self._tree = None
+        if self.locations:
+            self._tree = cKDTree(_ecef(self.latitudes, self.longitudes))
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __iter__(self):
+        return iter(self.locations)
+
+    def _refine(self, location: Location, idxs: Iterable[int]) -> List[int]:
+        # sort by index first so that ties are broken in the same order as a plain sort over the list
+        return sorted(sorted(idxs), key=lambda idx: location.distance(self.locations[idx]))
+
+    def k_nearest_idxs(self, location: Location, k: int) -> List[int]:
+        """
+        same as `k_nearest`, but returns the indices of the Locations (in the order they were given)
+        """
+        if not isinstance(location, Location):
+            raise TypeError(location)
+        if not isinstance(k, int):
+            raise TypeError
+        if k == 0:
+            raise ValueError(k)
+        if len(self.locations) < k:
+            raise ValueError(k)
+
+        # return all sorted if k is negative (or if we want everything anyway)
+        if k < 0 or k == len(self.locations):
+            return self._refine(location, range(len(self.locations)))
+
+        # the k nearest by chord distance give an upper bound on the geodesic distance to the true k-th nearest
+        point = _ecef([location.latitude], [location.longitude])[0]
+        _, idxs = self._tree.query(point, k=k)
+        idxs = np.atleast_1d(idxs)
+        max_distance = max(location.distance(self.locations[idx]) for idx in idxs)
+
+        # anything within that geodesic distance must also be within that chord distance, so refine all of those
+        # the extra 1mm is to absorb floating point error, on top of the error from rounding in the geodesic cache
+        radius = max_distance + geodesic_cache.max_error + 0.001
+        return self._refine(location, self._tree.query_ball_point(point, r=radius))[:k]
+
+    def k_nearest(self, location: Location, k: int) -> List[Location]:
+        """
+        same semantics as `Location.k_nearest`, but only computes vincenty for a handful of candidates
+        """
+        return [self.locations[idx] for idx in self.k_nearest_idxs(location, k)]
 
-        a more correct solution would be to test if this point is in a polygon
-        an appropriate polygon could be the Singapore shorelines or timezone boundary
+    def within_radius_idxs(self, location: Location, meters: float) -> List[int]:
+        """
+        same as `within_radius`, but returns the indices of the Locations (in the order they were given)
         """
-        return (1.2 <= self.latitude <= 1.5) and (103.6 <= self.longitude <= 104.1)
+        if not isinstance(location, Location):
+            raise TypeError(location)
+        if meters < 0:
+            raise ValueError(meters)
+        if not self.locations:
+            return []
+
+        point = _ecef([location.latitude], [location.longitude])[0]
+        radius = meters + geodesic_cache.max_error + 0.001
+        candidates = self._refine(location, self._tree.query_ball_point(point, r=radius))
+        # the cached distances can be off by `max_error`, which matters for small radii, so check the exact distance
+        return [idx for idx in candidates if location.distance(self.locations[idx], exact=True) <= meters]
+
+    def within_radius(self, location: Location, meters: float) -> List[Location]:
+        """
+        find all Locations within some geodesic distance, sorted nearest first
+        """
+        return [self.locations[idx] for idx in self.within_radius_idxs(location, meters)]
+
+
+class NearestTileTable:
+    """
+    precomputed candidates for `LocationIndex.k_nearest`, on a grid of lat/lon tiles (like geohash) over singapore
+    each tile stores every location that could be among the k nearest from anywhere in that tile (for k <= k_max),
+    so a query is one tile lookup plus vincenty for a handful of candidates, with the same results as the index
+    rebuild it whenever the index is rebuilt
+
+    for a tile center c with half-diagonal r, any k-th nearest location from a point p in the tile is at most
+    D_k(c) + r from p (triangle inequality), and therefore at most D_k(c) + 2r from c
+    """
+
+    # tiles cover this bounding box (all of singapore except pedra branca, which is too far out to be worth it)
+    bounding_box = (1.15, 103.55, 1.50, 104.15)  # lat_1, lon_1, lat_2, lon_2
+
+    def __init__(self, index: LocationIndex, k_max: int = 5, tile_size: float = 0.005):
+        """
+        :param index: the locations to look up
+        :param k_max: largest k that can be looked up without falling back to the index
+        :param tile_size: in degrees (0.005 degrees is about 550 meters)
+        """
+        if not isinstance(index, LocationIndex):
+            raise TypeError(index)
+        if k_max < 1:
+            raise ValueError(k_max)
+        if tile_size <= 0:
+            raise ValueError(tile_size)
+        self.index = index
+        self.k_max = min(k_max, len(index))
+        self.tile_size = tile_size
+
+        lat_1, lon_1, lat_2, lon_2 = self.bounding_box
+        self.lat_min = lat_1
+        self.lon_min = lon_1
+        self.n_rows = math.ceil((lat_2 - lat_1) / tile_size)
+        self.n_cols = math.ceil((lon_2 - lon_1) / tile_size)
+
+        # candidates for each tile, flattened (like a scipy csr matrix)
+        self._offsets = np.zeros(self.n_rows * self.n_cols + 1, dtype=np.int64)
+        self._candidates = np.zeros(0, dtype=np.int64)
+        if self.k_max < 1:
+            return
+
+        # the tile centers
+        rows, cols = np.divmod(np.arange(self.n_rows * self.n_cols), self.n_cols)
+        centers = _ecef(self.lat_min + (rows + 0.5) * tile_size, self.lon_min + (cols + 0.5) * tile_size)
+
+        # the kd-tree chord is never longer than the geodesic, and at most 0.01% shorter within a few hundred km
+        # a degree of latitude or longitude is at most 111.7km, so that bounds the half-diagonal of a tile
+        chords, _ = index._tree.query(centers, k=self.k_max)
+        max_distance = chords.reshape(len(centers), -1)[:, -1] * 1.0001
+        half_diagonal = math.hypot(tile_size / 2, tile_size / 2) * 111700
+        radii = max_distance + 2 * half_diagonal + 4 * geodesic_cache.max_error + 0.001  # see `GeodesicCache`
+
+        candidates = index._tree.query_ball_point(centers, r=radii)
+        self._offsets[1:] = np.cumsum([len(tile_candidates) for tile_candidates in candidates])
+        self._candidates = np.fromiter((idx for tile_candidates in candidates for idx in sorted(tile_candidates)),
+                                       dtype=np.int64, count=self._offsets[-1])
+
+    def tile_candidates(self, location: Location) -> Optional[np.ndarray]:
+        """
+        :return: the candidates for the tile containing this location (sorted), or None if it's outside the grid
+        """
+        row = math.floor((location.latitude - self.lat_min) / self.tile_size)
+        col = math.floor((location.longitude - self.lon_min) / self.tile_size)
+        if not (0 <= row < self.n_rows and 0 <= col < self.n_cols):
+            return None
+        tile = row * self.n_cols + col
+        return self._candidates[self._offsets[tile]:self._offsets[tile + 1]]
+
+    def k_nearest_idxs(self, location: Location, k: int) -> List[int]:
+        """
+        same as `LocationIndex.k_nearest_idxs`, falls back to it if the location is outside the grid or k > k_max
+        """
+        if not isinstance(location, Location):
+            raise TypeError(location)
+        if not isinstance(k, int):
+            raise TypeError
+        if not 0 < k <= self.k_max:
+            return self.index.k_nearest_idxs(location, k)
+        candidates = self.tile_candidates(location)
+        if candidates is None:
+            return self.index.k_nearest_idxs(location, k)
+
+        # same as `LocationIndex.k_nearest_idxs`, but only looking at the candidates in this tile
+        chords = np.linalg.norm(self.index._tree.data[candidates] - _ecef_point(location), axis=1)
+        distances = {idx: location.distance(self.index.locations[idx])
+                     for idx in candidates[np.argpartition(chords, k - 1)[:k]].tolist()}
+        radius = max(distances.values()) + geodesic_cache.max_error + 0.001
+        for idx in candidates[chords <= radius].tolist():
+            if idx not in distances:
+                distances[idx] = location.distance(self.index.locations[idx])
+        return sorted(sorted(distances), key=distances.get)[:k]
+
+    def k_nearest(self, location: Location, k: int) -> List[Location]:
+        return [self.index.locations[idx] for idx in self.k_nearest_idxs(location, k)]
+
+
+def haversine_distances(latitude, longitude, latitudes, longitudes) -> np.ndarray:
+    """
+    vectorized haversine distance in meters from one point to an array of points
+    (or elementwise, if the first point is also an array of points, or any other shapes that numpy can broadcast)
+    same spherical earth assumption as `_haversine`, so it's within about 0.6% of vincenty
+    """
+    lat_1 = np.radians(np.asarray(latitude, dtype=float))
+    lat_2 = np.radians(np.asarray(latitudes, dtype=float))
+    d_lat = lat_2 - lat_1
+    d_lon = np.radians(np.asarray(longitudes, dtype=float) - np.asarray(longitude, dtype=float))
+
+    a = np.sin(d_lat / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def equirectangular_distances(latitude, longitude, latitudes, longitudes) -> np.ndarray:
+    """
+    vectorized flat earth distance in meters, with longitudes scaled by the cosine of the mean latitude
+    cheaper than haversine and just as good over short distances near the equator (i.e. in singapore)
+    """
+    lat_1 = np.radians(np.asarray(latitude, dtype=float))
+    lat_2 = np.radians(np.asarray(latitudes, dtype=float))
+    d_lon = np.radians(np.asarray(longitudes, dtype=float) - np.asarray(longitude, dtype=float))
+    d_lon = (d_lon + math.pi) % (2 * math.pi) - math.pi  # take the short way around the antimeridian
+
+    return EARTH_RADIUS * np.hypot(lat_2 - lat_1, d_lon * np.cos((lat_1 + lat_2) / 2))
+
+
+_APPROXIMATE_DISTANCES = {
+    'haversine':       haversine_distances,
+    'equirectangular': equirectangular_distances,
+}
+
+
+def distance_matrix(locations_1: Union[Iterable[Location], LocationIndex],
+                    locations_2: Union[Iterable[Location], LocationIndex],
+                    method: str = 'haversine',
+                    ) -> np.ndarray:
+    """
+    approximate distance from every one of `locations_1` to every one of `locations_2`
+
+    :param method: 'haversine' or 'equirectangular'
+    :return: array of shape (len(locations_1), len(locations_2)) of distances in meters
+    """
+    latitudes_1, longitudes_1 = _coordinates(locations_1)
+    latitudes_2, longitudes_2 = _coordinates(locations_2)
+    return _APPROXIMATE_DISTANCES[method](latitudes_1[:, None], longitudes_1[:, None], latitudes_2, longitudes_2)
 
 
 def _haversine(loc_1: Location, loc_2: Location) -> float:
@@ -119,17 +541,15 @@ def _haversine(loc_1: Location, loc_2: Location) -> float:
     not the default distance because it's slightly less accurate
     it is faster, but then so is pythagoras on a flat earth model
     """
-    earth_radius = 6371008.8  # meters
-
     dLat = math.radians(loc_2.latitude - loc_1.latitude)
     dLon = math.radians(loc_2.longitude - loc_1.longitude)
-    loc_1.latitude = math.radians(loc_1.latitude)
-    loc_2.latitude = math.radians(loc_2.latitude)
+    lat_1 = math.radians(loc_1.latitude)
+    lat_2 = math.radians(loc_2.latitude)
 
-    a = math.sin(dLat / 2) ** 2 + math.cos(loc_1.latitude) * math.cos(loc_2.latitude) * math.sin(dLon / 2) ** 2
+    a = math.sin(dLat / 2) ** 2 + math.cos(lat_1) * math.cos(lat_2) * math.sin(dLon / 2) ** 2
     c = 2 * math.asin(math.sqrt(a))
 
-    return earth_radius * c
+    return EARTH_RADIUS * c
 
 
 def _pythagoras(loc_1: Location, loc_2: Location):
@@ -158,6 +578,13 @@ if __name__ == '__main__':
         d = l1.distance(l2)
     print(d, time.time() - t)
 
+    # vincenty, uncached, for each backend
+    for backend_name, backend in VINCENTY_BACKENDS.items():
+        t = time.time()
+        for _ in range(1000):
+            d = backend.Inverse(l1.latitude, l1.longitude, l2.latitude, l2.longitude)['s12']
+        print(backend_name, d, time.time() - t)
+
     # haversine
     t = time.time()
     for _ in range(1000):
@@ -169,3 +596,87 @@ if __name__ == '__main__':
     for _ in range(1000):
         d = _pythagoras(l1, l2)
     print(d, time.time() - t)
+
+    # one point to many (all of singapore), one at a time vs batched
+    rng = np.random.default_rng(0)
+    many = [Location(lat, lon) for lat, lon in zip(rng.uniform(1.2, 1.5, 10000), rng.uniform(103.6, 104.1, 10000))]
+
+    ds = dict()
+    for backend_name, backend in VINCENTY_BACKENDS.items():
+        t = time.time()
+        ds[backend_name] = np.array([backend.Inverse(l1.latitude, l1.longitude, x.latitude, x.longitude)['s12']
+                                     for x in many])
+        print(f'{backend_name} x{len(many)}', time.time() - t)
+
+    t = time.time()
+    ds['haversine, one at a time'] = np.array([_haversine(l1, x) for x in many])
+    print(f'haversine, one at a time x{len(many)}', time.time() - t)
+
+    for method in _APPROXIMATE_DISTANCES:
+        t = time.time()
+        ds[method] = l1.distances_to(many, method=method)
+        print(f'{method} x{len(many)}', time.time() - t)
+
+    for method, distances in ds.items():
+        print(f'{method} max relative error', np.max(np.abs(distances - ds['python']) / ds['python']))
+
+    t = time.time()
+    d = distance_matrix(many[:1000], many)
+    print(f'distance matrix {d.shape}', time.time() - t)
+
+    # k-nearest, sorting everything vs batched haversine vs using the index
+    points = [Location(lat, lon) for lat, lon in zip(rng.uniform(1.2, 1.5, 1000), rng.uniform(103.6, 104.1, 1000))]
+    queries = [Location(lat, lon) for lat, lon in zip(rng.uniform(1.2, 1.5, 10), rng.uniform(103.6, 104.1, 10))]
+
+    t = time.time()
+    index = LocationIndex(points)
+    print('build index', time.time() - t)
+
+    for query in queries:
+        assert query.k_nearest(index, k=3) == query.k_nearest(points, k=3) == query.k_nearest(points, k=-1)[:3]
+
+    geodesic_cache.clear()
+    t = time.time()
+    for query in queries:
+        d = query.k_nearest(points, k=-1)[:3]
+    print('sorted', time.time() - t)
+
+    geodesic_cache.clear()
+    t = time.time()
+    for query in queries:
+        d = query.k_nearest(points, k=3)
+    print('batched', time.time() - t)
+
+    geodesic_cache.clear()
+    t = time.time()
+    for query in queries:
+        d = query.k_nearest(index, k=3)
+    print('indexed', time.time() - t)
+
+    t = time.time()
+    tiles = NearestTileTable(index)
+    print('build tiles', time.time() - t)
+
+    for query in queries:
+        assert tiles.k_nearest(query, k=3) == query.k_nearest(index, k=3)
+
+    # both cached, since vincenty would dominate otherwise
+    t = time.time()
+    for query in queries * 100:
+        d = query.k_nearest(index, k=3)
+    print('indexed x100', time.time() - t)
+
+    t = time.time()
+    for query in queries * 100:
+        d = tiles.k_nearest(query, k=3)
+    print('tiled x100', time.time() - t)
+
+    # repeated lookups from around the same place (e.g. gps jitter), which never hit a cache keyed on exact floats
+    geodesic_cache.clear()
+    jittered = [Location(query.latitude + dy, query.longitude + dx)
+                for query in queries
+                for dy, dx in zip(rng.normal(0, 1e-6, 100), rng.normal(0, 1e-6, 100))]
+    t = time.time()
+    for query in jittered:
+        d = query.k_nearest(index, k=3)
+    print('indexed, jittered', time.time() - t, f'hit rate {geodesic_cache.hit_rate:.3f}', len(geodesic_cache))
@@ -5,8 +5,8 @@ from typing import List
 from typing import Tuple
 
 import dateutil.parser
-import requests
 
+from api_wrappers import transport
 from api_wrappers.caching import cache_1m
 from api_wrappers.data_gov_sg_v2.weather import Forecast
 from api_wrappers.data_gov_sg_v2.weather import FourDayForecast
@@ -76,7 +76,8 @@ zone_rename = {
 
 @cache_1m
 def weather_2h() -> List[Forecast]:
-    r = requests.get('https://www.nea.gov.sg/api/WeatherForecast/forecast24hrnowcast2hrs/0', verify=False)
+    r = transport.get('https://www.nea.gov.sg/api/WeatherForecast/forecast24hrnowcast2hrs/0',
+                      verify=transport.SG_GOV_VERIFY_TLS)
     data = r.json()
 
     # timestamp
@@ -97,7 +98,8 @@ def weather_2h() -> List[Forecast]:
 
 @cache_1m
 def weather_24h() -> List[Forecast]:
-    r = requests.get('https://www.nea.gov.sg/api/WeatherForecast/forecast24hrnowcast2hrs/0', verify=False)
+    r = transport.get('https://www.nea.gov.sg/api/WeatherForecast/forecast24hrnowcast2hrs/0',
+                      verify=transport.SG_GOV_VERIFY_TLS)
     data = r.json()
     out = []
 
@@ -158,7 +160,7 @@ def weather_4d() -> List[FourDayForecast]:
         day = ['SUN', 'MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT'][int(date.strftime('%w'))]
         day_lookup[day] = date
 
-    r = requests.get('https://www.nea.gov.sg/api/Weather4DayOutlook/GetData/0', verify=False)
+    r = transport.get('https://www.nea.gov.sg/api/Weather4DayOutlook/GetData/0', verify=transport.SG_GOV_VERIFY_TLS)
     data = r.json()
     first_date = day_lookup[data[0]['day']]
     out = []
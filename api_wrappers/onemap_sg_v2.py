@@ -1,18 +1,38 @@
 """
-there's a limit of 250 calls per minute to the onemap sg api
+there's a limit of 250 calls per minute to the onemap sg api, so all calls go through `onemap_rate_limiter`
 """
+import functools
 import json
 import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from functools import lru_cache
 from pprint import pprint
+from typing import Any
+from typing import Dict
 from typing import List
 from typing import Optional
 
 import requests
 
+from api_wrappers import svy21
+from api_wrappers import transport
 from api_wrappers.caching import cache_1m
+from api_wrappers.caching import cache_swr
+from api_wrappers.gazetteer import postal_codes
 from api_wrappers.location import Location
+from api_wrappers.rate_limiting import Priority
+from api_wrappers.rate_limiting import onemap_rate_limiter
+from api_wrappers.sqlite_cache import api_cache
+
+
+class OneMapError(RuntimeError):
+    """
+    onemap returned an error instead of results, which shouldn't be cached as if there were no results
+    """
+    pass
 
 
 @dataclass
@@ -76,36 +96,54 @@ class OneMapResult(Location):
             return 'Unknown location'
 
 
+def _match_rank(query: str, result: OneMapResult) -> int:
+    """
+    how well a result matches the query, lower is better
+    0: zipcode, 1: building name, 2: road name, 3: acronym, 4: partial name, 5: partial road, 6: no match
+    """
+    if result.zipcode == query:
+        return 0
+    elif result.building_name.casefold() == query.casefold():
+        return 1
+    elif result.road_name.casefold().split() == query.casefold().split():
+        return 2
+    elif result.building_name.casefold().endswith(f'({query.casefold()})'):
+        return 3  # technically most of these would be an initialism, not an acronym
+    elif query.casefold() in result.building_name.casefold():
+        return 4
+    elif f' {" ".join(query.casefold().split())} ' in f' {" ".join(result.road_name.casefold().split())} ':
+        return 5  # whole words only, e.g. "bedok north" but not "dok"
+    else:
+        return 6
+
+
 def _reorder_onemap_results(query: str, results: List[OneMapResult]) -> List[OneMapResult]:
-    match_zip = []
-    match_name = []
-    match_address = []
-    match_acronym = []  # technically most of these would be an initialism, not an acronym
-    partial_name = []
-    partial_road = []
-    non_match = []
-
-    # bucketed sort (kind of like radix)
-    for result in results:
-        if result.zipcode == query:
-            match_zip.append(result)
-        elif result.building_name.casefold() == query.casefold():
-            match_name.append(result)
-        elif result.road_name.casefold().split() == query.casefold():
-            match_address.append(result)
-        elif result.building_name.casefold().endswith(f'({query.casefold()})'):
-            match_acronym.append(result)
-        elif query.casefold() in result.building_name.casefold():
-            partial_name.append(result)
-        elif query.casefold() in result.road_name.casefold().split():
-            partial_road.append(result)
-        else:
-            non_match.append(result)
+    # stable sort, so the original order is kept within each rank
+    return sorted(results, key=lambda result: _match_rank(query, result))
 
-    return match_zip + match_name + match_address + match_acronym + partial_name + partial_road + non_match
 
+# a local result at least this good (i.e. an exact match) is trusted without asking onemap
+_LOCAL_CONFIDENT_RANK = 3
 
-@cache_1m
+
+# shared by all searches, so a burst of broad queries can't open too many connections (or use up the rate limit)
+_onemap_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='onemap-search')
+
+
+def _onemap_search_page(query: str, page_num: int, priority: Optional[Priority] = None) -> dict:
+    # `_onemap_get` already retries (taking a rate limit token each time), so there's no retry loop here
+    r = _onemap_get('https://www.onemap.gov.sg/api/common/elastic/search',
+                    {'searchVal':      query,
+                     'returnGeom':     'Y',
+                     'getAddrDetails': 'Y',
+                     'pageNum':        page_num},
+                    priority=priority)
+    return json.loads(r.content)
+
+
+# addresses rarely change, so it's fine to serve an old result (and if onemap is down, much better than nothing)
+# and it's kept on disk, so it survives restarts
+@cache_swr(60 * 60, 24 * 60 * 60, disk=api_cache)
 def onemap_search(query, result_limit=25) -> List[OneMapResult]:
     """
     Each page of json response is restricted to a maximum of 10 results.
@@ -123,35 +161,26 @@ def onemap_search(query, result_limit=25) -> List[OneMapResult]:
         logging.info('QUERY_ONEMAP_BLANK')
         return []
 
-    results = []
-    page_num = 0
-    total_pages = 1
-    while page_num < total_pages:
-        page_num += 1
-        data = dict()
-
-        # run query
-        for retry_attempt in range(3):
-            # noinspection PyBroadException
-            try:
-                r = requests.get('https://www.onemap.gov.sg/api/common/elastic/search',
-                                 params={'searchVal':      query,
-                                         'returnGeom':     'Y',
-                                         'getAddrDetails': 'Y',
-                                         'pageNum':        page_num},
-                                 verify=False,
-                                 headers={'authorization': f'Bearer {onemap_token()}'})
-                data = json.loads(r.content)
-                break
+    # the first page tells us how many pages there are
+    pages = [_onemap_search_page(query, 1)]
+    total_pages = pages[0].get('totalNumPages', 1)
 
-            except Exception:
-                if retry_attempt == 2:
-                    raise
+    # then we get the rest of the pages we need (if any) all at once
+    if 'error' not in pages[0] and total_pages > 1:
+        page_size = max(len(pages[0].get('results', [])), 1)
+        last_page_num = min(total_pages, math.ceil(result_limit / page_size))
+        # the pool threads don't inherit our priority, so we pass it along explicitly
+        pages.extend(_onemap_search_pool.map(functools.partial(_onemap_search_page,
+                                                               query,
+                                                               priority=onemap_rate_limiter.current_priority()),
+                                             range(2, last_page_num + 1)))
 
-        # catch error
+    results = []
+    for page_num, data in enumerate(pages, start=1):
+        # raise instead of returning partial results, so the cache keeps the last good results instead
         if 'error' in data:
             logging.warning(f'QUERY_ONEMAP_ERROR={query} PAGE_NUM={page_num}')
-            return _reorder_onemap_results(query, results)[:result_limit]
+            raise OneMapError(query, page_num, data['error'])
 
         # append to results
         for result in data.get('results', []):
@@ -167,36 +196,189 @@ def onemap_search(query, result_limit=25) -> List[OneMapResult]:
                                         ))
 
         # check number of pages and results
-        total_pages = data.get('totalNumPages', page_num)
         assert page_num == data.get('pageNum', page_num), data
         if page_num == total_pages:
             assert len(results) == data['found'], data
 
-        # if we have enough results, stop querying
-        if len(results) >= result_limit:
-            break
+    # remember every postal code we see, so `locate_zipcode` doesn't need to call onemap for them
+    postal_codes.add_many(results)
 
     return _reorder_onemap_results(query, results)[:result_limit]
 
 
-@cache_1m
+def search_address(query: str, result_limit: int = 25) -> List[OneMapResult]:
+    """
+    search the local gazetteer first (every address onemap has ever given us, the hawker centres, and anything
+    bulk loaded), and only search onemap if the best local result isn't an exact match for the query
+    """
+    query = query.strip()
+
+    # a postal code is looked up directly, since the full-text index doesn't cover postal codes
+    if len(query) == 6 and query.isdigit():
+        known = postal_codes.get(query)
+        if known is not None:
+            logging.info(f'QUERY_LOCAL_ZIPCODE="{query}" RESULT="{known["building_name"]}"')
+            return [OneMapResult(**known)]
+
+    results = _reorder_onemap_results(query, [OneMapResult(**row)
+                                              for row in postal_codes.search(query, limit=result_limit)])
+    if results and _match_rank(query, results[0]) <= _LOCAL_CONFIDENT_RANK:
+        logging.info(f'QUERY_LOCAL="{query}" NUM_RESULTS={len(results)} RESULT="{results[0].building_name}"')
+        return results
+
+    try:
+        return onemap_search(query, result_limit)
+    except OneMapError:
+        return []  # already logged, and there's no older result to fall back on
+
+
+class OneMapTokenManager:
+    """
+    onemap access tokens are valid for 3 days, so we keep one until just before it expires instead of re-authenticating
+    * once the token is within `refresh_margin` of expiry, it's refreshed in a background thread
+      (if that fails, it's retried no more than once every `retry_interval`)
+    * if the token has expired (or was rejected), callers block on the refresh
+    * concurrent refreshes are collapsed into one, the other callers just wait for it and use the new token
+    """
+
+    def __init__(self,
+                 secrets_path: str = 'secrets.json',
+                 refresh_margin: float = 60 * 60,  # seconds
+                 expiry_margin: float = 60,  # seconds, in case our clock is a little off
+                 retry_interval: float = 5 * 60,  # seconds between background refresh attempts
+                 ):
+        self.secrets_path = secrets_path
+        self.refresh_margin = refresh_margin
+        self.expiry_margin = expiry_margin
+        self.retry_interval = retry_interval
+
+        self._lock = threading.Lock()  # held while refreshing
+        self._token: Optional[str] = None
+        self._expiry: float = 0  # unix timestamp
+
+        # a separate lock, so starting a background refresh never waits for a refresh in progress
+        self._background_lock = threading.Lock()
+        self._background_refresh: Optional[threading.Thread] = None
+        self._background_failed: float = 0  # unix timestamp of the last failed background refresh
+
+    def _is_valid(self, token: Optional[str] = None) -> bool:
+        if self._token is None or time.time() >= self._expiry - self.expiry_margin:
+            return False
+        return token is None or self._token != token
+
+    def _get_token(self):
+        with open(self.secrets_path) as f:
+            secrets = json.load(f)
+        onemap_rate_limiter.acquire(Priority.INTERACTIVE)  # everything else is waiting on this
+        r = transport.post('https://www.onemap.gov.sg/api/auth/post/getToken',
+                           json={
+                               'email':    secrets['onemap_email'],
+                               'password': secrets['onemap_password'],
+                           },
+                           verify=transport.SG_GOV_VERIFY_TLS)
+        data = json.loads(r.content)
+        logging.info(f'ONEMAP_TOKEN="{data["access_token"]}" '
+                     f'EXPIRY={data["expiry_timestamp"]} '
+                     f'EMAIL="{secrets["onemap_email"]}"')
+        self._token = data['access_token']
+        self._expiry = float(data['expiry_timestamp'])
+
+    def refresh(self, stale_token: Optional[str] = None) -> str:
+        """
+        get a new token, unless someone else already replaced `stale_token` while we were waiting for the lock
+
+        :param stale_token: the token that has expired or was rejected (None to always get a new token)
+        """
+        with self._lock:
+            if not self._is_valid(stale_token):
+                self._get_token()
+            return self._token
+
+    def _refresh_in_background(self, stale_token: str):
+        # noinspection PyBroadException
+        try:
+            self.refresh(stale_token)
+        except Exception:
+            # the current token is still valid for a while, so we can try again later
+            with self._background_lock:
+                self._background_failed = time.time()
+            logging.exception('ONEMAP_TOKEN_REFRESH_FAILED')
+
+    def token(self) -> str:
+        if not self._is_valid():
+            return self.refresh(self._token)
+
+        # refresh proactively, so callers never have to wait
+        if time.time() >= self._expiry - self.refresh_margin:
+            with self._background_lock:
+                if time.time() - self._background_failed < self.retry_interval:
+                    pass  # don't hammer the token endpoint (and use up the rate limit) if it's failing
+                elif self._background_refresh is None or not self._background_refresh.is_alive():
+                    self._background_refresh = threading.Thread(target=self._refresh_in_background,
+                                                                args=(self._token,),
+                                                                name='refresh-onemap-token',
+                                                                daemon=True)
+                    self._background_refresh.start()
+
+        return self._token
+
+
+onemap_token_manager = OneMapTokenManager()
+
+
 def onemap_token() -> str:
-    with open('secrets.json') as f:
-        secrets = json.load(f)
-    r = requests.post('https://www.onemap.gov.sg/api/auth/post/getToken',
-                      json={
-                          'email':    secrets['onemap_email'],
-                          'password': secrets['onemap_password'],
-                      },
-                      verify=False)
-    data = json.loads(r.content)
-    logging.info(f'ONEMAP_TOKEN="{data["access_token"]}" '
-                 f'EXPIRY={data["expiry_timestamp"]} '
-                 f'EMAIL="{secrets["onemap_email"]}"')
-    return data['access_token']
+    return onemap_token_manager.token()
 
 
-@cache_1m
+def _onemap_get(url: str, params: Dict[str, Any], priority: Optional[Priority] = None) -> requests.Response:
+    """
+    rate-limited, authenticated GET
+    * if the token is rejected (e.g. it was revoked), get a new token and retry once
+    * connection errors, 429s, and 5xxs are retried with exponential backoff (like `transport.RETRY`, which
+      doesn't apply to onemap), and every attempt takes a token, so retries can't exceed the rate limit either
+
+    :param priority: defaults to the current priority (see `TokenBucket.priority`)
+    """
+    token = onemap_token()
+    refreshed_token = False
+    attempt = 0
+    while True:
+        onemap_rate_limiter.acquire(priority)
+        try:
+            r = transport.get(url,
+                              params=params,
+                              headers={'authorization': f'Bearer {token}'},
+                              verify=transport.SG_GOV_VERIFY_TLS)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= transport.RETRY.total:
+                raise
+            logging.warning(f'ONEMAP_RETRY URL="{url}" ATTEMPT={attempt} ERROR="{e!r}"')
+            time.sleep(transport.RETRY.backoff_factor * 2 ** attempt)
+            attempt += 1
+            continue
+
+        if r.status_code == 401 and not refreshed_token:
+            logging.warning(f'ONEMAP_UNAUTHORIZED URL="{url}"')
+            token = onemap_token_manager.refresh(token)
+            refreshed_token = True
+            continue
+
+        if r.status_code in transport.RETRY.status_forcelist and attempt < transport.RETRY.total:
+            backoff = transport.RETRY.backoff_factor * 2 ** attempt
+            # noinspection PyBroadException
+            try:
+                backoff = max(backoff, min(60.0, float(r.headers.get('Retry-After', 0))))
+            except Exception:
+                pass  # it can also be an http date, which we don't bother with
+            logging.warning(f'ONEMAP_RETRY URL="{url}" ATTEMPT={attempt} STATUS={r.status_code}')
+            time.sleep(backoff)
+            attempt += 1
+            continue
+
+        return r
+
+
+@cache_swr(60 * 60, 24 * 60 * 60, disk=api_cache)
 def onemap_reverse_geocode(lat: float,
                            lon: float,
                            buffer: int = 50,
@@ -214,29 +396,29 @@ def onemap_reverse_geocode(lat: float,
     :return:
     """
     assert 0 <= buffer <= 500
-    r = requests.get('https://www.onemap.gov.sg/api/public/revgeocode',
-                     params={'location':      f'{lat},{lon}',
-                             'buffer':        buffer,
-                             'addressType':   address_type,
-                             'otherFeatures': 'Y' if other_features else 'N'},
-                     verify=False,
-                     headers={'authorization': f'Bearer {onemap_token()}'})
+    r = _onemap_get('https://www.onemap.gov.sg/api/public/revgeocode',
+                    {'location':      f'{lat},{lon}',
+                     'buffer':        buffer,
+                     'addressType':   address_type,
+                     'otherFeatures': 'Y' if other_features else 'N'})
     data = json.loads(r.content)
-    return [OneMapResult(block_no=result['BLOCK'],
-                         road_name=result['ROAD'],
-                         building_name=result['BUILDINGNAME'],
-                         zipcode=result['POSTALCODE'],
-                         latitude=float(result['LATITUDE']),
-                         longitude=float(result['LONGITUDE']),
-                         svy21_x=float(result['XCOORD']),
-                         svy21_y=float(result['YCOORD']),
-                         ) for result in data['GeocodeInfo']]
-
-
-@lru_cache
+    results = [OneMapResult(block_no=result['BLOCK'],
+                            road_name=result['ROAD'],
+                            building_name=result['BUILDINGNAME'],
+                            zipcode=result['POSTALCODE'],
+                            latitude=float(result['LATITUDE']),
+                            longitude=float(result['LONGITUDE']),
+                            svy21_x=float(result['XCOORD']),
+                            svy21_y=float(result['YCOORD']),
+                            ) for result in data['GeocodeInfo']]
+    postal_codes.add_many(results)
+    return results
+
+
 def onemap_convert(lat: float, lon: float, input_epsg: int, output_epsg: int):
     """
     returns a dict with `X` and `Y` or `latitude` and `longitude`
+    same output as the onemap convert api, but computed locally (see `api_wrappers.svy21`)
 
     :param lat: or X
     :param lon: or Y
@@ -257,16 +439,23 @@ def onemap_convert(lat: float, lon: float, input_epsg: int, output_epsg: int):
     if input_epsg == output_epsg:
         return lat, lon
 
-    # query
-    r = requests.get(f'https://www.onemap.gov.sg/api/common/convert/{input_epsg}to{output_epsg}',
-                     params={'X':         lat,
-                             'latitude':  lat,
-                             'Y':         lon,
-                             'longitude': lon},
-                     verify=False,
-                     headers={'authorization': f'Bearer {onemap_token()}'})
+    x, y = svy21.convert(lat, lon, input_epsg, output_epsg)
+    if output_epsg == 4326:
+        return {'latitude': float(x), 'longitude': float(y)}
+    return {'X': float(x), 'Y': float(y)}
+
+
+def onemap_planning_areas(year: int = 2019) -> Dict[str, dict]:
+    """
+    URA master plan planning area boundaries, which only change when there's a new master plan
+    the geometries are geojson MultiPolygons, keyed by planning area name
+
+    :param year: 1998, 2008, 2014, or 2019
+    """
+    r = _onemap_get('https://www.onemap.gov.sg/api/public/popapi/getAllPlanningarea',
+                    {'year': year})
     data = json.loads(r.content)
-    return data
+    return {result['pln_area_n']: json.loads(result['geojson']) for result in data['SearchResults']}
 
 
 @cache_1m
@@ -280,17 +469,35 @@ def onemap_routing_service(start_lat: float,
         raise ValueError('unsupported route type')
 
     # query
-    r = requests.get('https://www.onemap.gov.sg//api/public/routingsvc/route',
-                     params={'start':     f'{start_lat},{start_lon}',
-                             'end':       f'{end_lat},{end_lon}',
-                             'routeType': route_type},
-                     verify=False,
-                     headers={'authorization': f'Bearer {onemap_token()}'})
+    r = _onemap_get('https://www.onemap.gov.sg//api/public/routingsvc/route',
+                    {'start':     f'{start_lat},{start_lon}',
+                     'end':       f'{end_lat},{end_lon}',
+                     'routeType': route_type})
     data = json.loads(r.content)
     return data  # ['route_summary']
 
 
 if __name__ == '__main__':
+    # match ranks, including multi-word road names
+    _result = OneMapResult(block_no='30',
+                           road_name='SENG POH ROAD',
+                           building_name='TIONG BAHRU MARKET',
+                           zipcode='168898',
+                           latitude=1.2848,
+                           longitude=103.8326,
+                           svy21_x=28032.0,
+                           svy21_y=29889.0,
+                           )
+    assert _match_rank('168898', _result) == 0
+    assert _match_rank('tiong bahru market', _result) == 1
+    assert _match_rank('Seng Poh Road', _result) == 2
+    assert _match_rank('seng  poh road', _result) == 2
+    assert _match_rank('MBS', _result) == 6
+    assert _match_rank('bahru', _result) == 4
+    assert _match_rank('seng poh', _result) == 5
+    assert _match_rank('poh', _result) == 5
+    assert _match_rank('eng poh', _result) == 6
+
     # pprint(onemap_reverse_geocode(1.407550, 103.741132))
     # pprint(onemap_reverse_geocode(1.4040451,103.7438601))
     # pprint(onemap_reverse_geocode(1.397511, 103.747441))
@@ -298,5 +505,6 @@ if __name__ == '__main__':
     # pprint(onemap_search('yew tee mrt'))
     # pprint(onemap_search('688249'))
     pprint(onemap_search('95 Choa Chu Kang Way'))
+    # pprint(search_address('tiong bahru market'))
     # pprint(onemap_routing_service(1.4040451, 103.7438601, 1.3975115670543203, 103.74744162337753))
     # pprint(onemap_convert(1.319728905, 103.8421581, 4326, 3857))
@@ -0,0 +1,291 @@
+"""
+fast point-in-polygon tests for a fixed set of polygons (e.g. the singapore boundary)
+coordinates are treated as planar (longitude, latitude), which is how geojson polygons are drawn anyway
+"""
+import json
+import math
+import re
+import time
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+
+# cell states
+OUTSIDE = 0
+INSIDE = 1
+BOUNDARY = 2
+
+
+class PreparedPolygon:
+    """
+    a multipolygon (with holes) preprocessed into a grid of cells that are entirely inside, entirely outside,
+    or on the boundary, so most points are resolved with a single lookup
+    points in boundary cells are resolved exactly by ray casting, but only against the edges in that row of cells
+
+    uses the even-odd rule, so holes are just more rings
+    """
+
+    def __init__(self, rings: Sequence[Sequence[Tuple[float, float]]], cell_size: float = 0.005):
+        """
+        :param rings: every ring (outer boundaries and holes) of every polygon, as (longitude, latitude) pairs
+        :param cell_size: in degrees (0.005 degrees is about 550 meters)
+        """
+        if cell_size <= 0:
+            raise ValueError(cell_size)
+        self.cell_size = cell_size
+
+        # flatten all the rings into a list of edges
+        starts = []
+        ends = []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=float)
+            if len(ring) < 3:
+                raise ValueError(ring)
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])  # close the ring
+            starts.append(ring[:-1])
+            ends.append(ring[1:])
+        if not starts:
+            raise ValueError(rings)
+        starts = np.vstack(starts)
+        ends = np.vstack(ends)
+        self._x1, self._y1 = starts[:, 0], starts[:, 1]
+        self._x2, self._y2 = ends[:, 0], ends[:, 1]
+
+        # grid over the bounding box of the polygon
+        self.x_min = float(min(self._x1.min(), self._x2.min()))
+        self.y_min = float(min(self._y1.min(), self._y2.min()))
+        self.n_cols = max(1, math.ceil((max(self._x1.max(), self._x2.max()) - self.x_min) / cell_size))
+        self.n_rows = max(1, math.ceil((max(self._y1.max(), self._y2.max()) - self.y_min) / cell_size))
+
+        # edges that cross each row of cells (half-open in y, same as the ray casting)
+        edge_y_min = np.minimum(self._y1, self._y2)
+        edge_y_max = np.maximum(self._y1, self._y2)
+        self._row_edges: List[np.ndarray] = []
+        for row in range(self.n_rows):
+            row_y_min = self.y_min + row * cell_size
+            row_y_max = row_y_min + cell_size
+            self._row_edges.append(np.flatnonzero((edge_y_min <= row_y_max) & (edge_y_max >= row_y_min)))
+
+        # any cell touched by an edge is a boundary cell, which is conservative since we check against the bboxes
+        self.cells = np.full((self.n_rows, self.n_cols), OUTSIDE, dtype=np.int8)
+        for x1, y1, x2, y2 in zip(self._x1, self._y1, self._x2, self._y2):
+            # walk along the edge in small steps, marking the cells on both sides of each step
+            steps = max(1, math.ceil(max(abs(x2 - x1), abs(y2 - y1)) / cell_size * 2))
+            xs = np.linspace(x1, x2, steps + 1)
+            ys = np.linspace(y1, y2, steps + 1)
+            cols = np.floor((xs - self.x_min) / cell_size).astype(int)
+            rows = np.floor((ys - self.y_min) / cell_size).astype(int)
+            for d_row in (-1, 0, 1):
+                for d_col in (-1, 0, 1):
+                    r = np.clip(rows + d_row, 0, self.n_rows - 1)
+                    c = np.clip(cols + d_col, 0, self.n_cols - 1)
+                    self.cells[r, c] = BOUNDARY
+
+        # every other cell is entirely inside or entirely outside, so just check its center
+        rows, cols = np.nonzero(self.cells != BOUNDARY)
+        centers_x = self.x_min + (cols + 0.5) * cell_size
+        centers_y = self.y_min + (rows + 0.5) * cell_size
+        for row, col, x, y in zip(rows, cols, centers_x, centers_y):
+            if self._ray_cast(row, x, y):
+                self.cells[row, col] = INSIDE
+
+    def _ray_cast(self, row: int, x: float, y: float) -> bool:
+        """
+        exact even-odd test, casting a ray towards +x against only the edges in this row
+        """
+        edges = self._row_edges[row]
+        x1, y1, x2, y2 = self._x1[edges], self._y1[edges], self._x2[edges], self._y2[edges]
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_intersect = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        return bool(np.count_nonzero(crosses & (x < x_intersect)) % 2)
+
+    def contains(self, longitude: float, latitude: float) -> bool:
+        col = math.floor((longitude - self.x_min) / self.cell_size)
+        row = math.floor((latitude - self.y_min) / self.cell_size)
+        if not (0 <= row < self.n_rows and 0 <= col < self.n_cols):
+            return False
+        cell = self.cells[row, col]
+        if cell == BOUNDARY:
+            return self._ray_cast(row, longitude, latitude)
+        return cell == INSIDE
+
+    def contains_many(self, longitudes, latitudes) -> np.ndarray:
+        """
+        vectorized `contains`, only the points in boundary cells need to be ray cast
+        """
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        cols = np.floor((longitudes - self.x_min) / self.cell_size)
+        rows = np.floor((latitudes - self.y_min) / self.cell_size)
+        in_grid = (0 <= rows) & (rows < self.n_rows) & (0 <= cols) & (cols < self.n_cols)
+
+        out = np.zeros(longitudes.shape, dtype=bool)
+        cells = np.full(longitudes.shape, OUTSIDE, dtype=np.int8)
+        cells[in_grid] = self.cells[rows[in_grid].astype(int), cols[in_grid].astype(int)]
+        out[cells == INSIDE] = True
+        for idx in zip(*np.nonzero(cells == BOUNDARY)):
+            out[idx] = self._ray_cast(int(rows[idx]), longitudes[idx], latitudes[idx])
+        return out
+
+    @staticmethod
+    def from_geojson(path: Union[str, Path], cell_size: float = 0.005) -> 'PreparedPolygon':
+        """
+        all the Polygon and MultiPolygon geometries in a geojson file, as one big multipolygon
+        """
+        with Path(path).open(encoding='utf8') as f:
+            data = json.load(f)
+
+        rings = []
+        for feature in data.get('features', [data]):
+            geometry = feature.get('geometry', feature)
+            if geometry['type'] == 'Polygon':
+                rings.extend(geometry['coordinates'])
+            elif geometry['type'] == 'MultiPolygon':
+                for polygon in geometry['coordinates']:
+                    rings.extend(polygon)
+        return PreparedPolygon(rings, cell_size=cell_size)
+
+
+class PolygonRegions:
+    """
+    a set of named (multi)polygons, e.g. the URA planning areas, for assigning points to regions
+    meant for a few thousand points at a time, so there's no grid, just a bounding box check and vectorized ray casting
+    """
+
+    def __init__(self, regions: Dict[str, Sequence[Sequence[Tuple[float, float]]]]):
+        """
+        :param regions: every ring (outer boundaries and holes) of every polygon in each region, by region name
+        """
+        self.names: List[str] = list(regions)
+        self._edges: List[np.ndarray] = []  # (x1, y1, x2, y2) for each edge
+        self._bounding_boxes: List[Tuple[float, float, float, float]] = []  # (x_min, y_min, x_max, y_max)
+        for name in self.names:
+            edges = []
+            for ring in regions[name]:
+                ring = np.asarray(ring, dtype=float)
+                if len(ring) < 3:
+                    raise ValueError(ring)
+                if not np.array_equal(ring[0], ring[-1]):
+                    ring = np.vstack([ring, ring[:1]])  # close the ring
+                edges.append(np.hstack([ring[:-1], ring[1:]]))
+            if not edges:
+                raise ValueError(name)
+            edges = np.vstack(edges)
+            self._edges.append(edges)
+            self._bounding_boxes.append((float(edges[:, [0, 2]].min()), float(edges[:, [1, 3]].min()),
+                                         float(edges[:, [0, 2]].max()), float(edges[:, [1, 3]].max())))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def regions_of_many(self, longitudes, latitudes) -> List[Optional[str]]:
+        """
+        the name of the (first) region containing each point, or None if it's not in any region
+        """
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        out: List[Optional[str]] = [None] * len(longitudes)
+        unassigned = np.ones(len(longitudes), dtype=bool)
+
+        for name, edges, (x_min, y_min, x_max, y_max) in zip(self.names, self._edges, self._bounding_boxes):
+            idxs = np.flatnonzero(unassigned &
+                                  (x_min <= longitudes) & (longitudes <= x_max) &
+                                  (y_min <= latitudes) & (latitudes <= y_max))
+            if not len(idxs):
+                continue
+
+            # even-odd ray casting towards +x, for every (point, edge) pair at once
+            x = longitudes[idxs, None]
+            y = latitudes[idxs, None]
+            x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crosses = ((y1 > y) != (y2 > y)) & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+            for idx in idxs[np.count_nonzero(crosses, axis=1) % 2 == 1]:
+                out[idx] = name
+                unassigned[idx] = False
+
+        return out
+
+    def region_of(self, longitude: float, latitude: float) -> Optional[str]:
+        return self.regions_of_many([longitude], [latitude])[0]
+
+    @staticmethod
+    def from_geojson(path: Union[str, Path], name_property: str) -> 'PolygonRegions':
+        """
+        each Polygon or MultiPolygon feature in a geojson file is a region, named by one of its properties
+        features with the same name are merged
+
+        if the property isn't there, look for it in the kml-style html table in the description,
+        which is how data.gov.sg exports some of its datasets
+        """
+        with Path(path).open(encoding='utf8') as f:
+            data = json.load(f)
+
+        regions = dict()
+        for feature in data['features']:
+            properties = feature.get('properties') or dict()
+            name = properties.get(name_property)
+            if name is None:
+                m = re.search(rf'<th>{re.escape(name_property)}</th>\s*<td>(?P<name>[^<]*)</td>',
+                              properties.get('Description', ''))
+                if m is None:
+                    raise KeyError(name_property)
+                name = m.group('name')
+
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                regions.setdefault(name, []).extend(geometry['coordinates'])
+            elif geometry['type'] == 'MultiPolygon':
+                for polygon in geometry['coordinates']:
+                    regions.setdefault(name, []).extend(polygon)
+        return PolygonRegions(regions)
+
+
+def _ray_cast_all(rings: Sequence[Sequence[Tuple[float, float]]], x: float, y: float) -> bool:
+    """
+    reference implementation without the grid, for testing
+    """
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+    return inside
+
+
+if __name__ == '__main__':
+    with open('data/singapore-boundary/singapore-boundary.geojson', encoding='utf8') as f:
+        boundary_rings = [ring
+                          for feature in json.load(f)['features']
+                          for polygon in feature['geometry']['coordinates']
+                          for ring in polygon]
+
+    t = time.time()
+    polygon = PreparedPolygon.from_geojson('data/singapore-boundary/singapore-boundary.geojson')
+    print('prepare', time.time() - t, polygon.cells.shape, np.bincount(polygon.cells.ravel()))
+
+    rng = np.random.default_rng(0)
+    lons = rng.uniform(103.5, 104.7, 100000)
+    lats = rng.uniform(1.1, 1.6, 100000)
+
+    t = time.time()
+    expected = [_ray_cast_all(boundary_rings, lon, lat) for lon, lat in zip(lons[:10000], lats[:10000])]
+    print('ray cast everything x10000', time.time() - t)
+
+    t = time.time()
+    actual = [polygon.contains(lon, lat) for lon, lat in zip(lons[:10000], lats[:10000])]
+    print('prepared x10000', time.time() - t)
+    assert actual == expected
+
+    t = time.time()
+    actual = polygon.contains_many(lons, lats)
+    print('prepared, batched x100000', time.time() - t)
+    assert actual[:10000].tolist() == expected
@@ -4,6 +4,8 @@ from functools import lru_cache
 from pprint import pprint
 from typing import Optional
 
+from api_wrappers.gazetteer import postal_codes
+from api_wrappers.onemap_sg_v2 import OneMapError
 from api_wrappers.onemap_sg_v2 import OneMapResult
 from api_wrappers.onemap_sg_v2 import onemap_search
 
@@ -93,13 +95,23 @@ def fix_zipcode(query: str) -> str:
 
 def locate_zipcode(zipcode: str) -> Optional[OneMapResult]:
     """
-    `query_onemap` is already cached
+    check the offline gazetteer first, and only query onemap if we've never seen this postal code
     """
     zipcode = fix_zipcode(zipcode)
 
+    known = postal_codes.get(zipcode)
+    if known is not None:
+        return OneMapResult(**known)
+
     # query zip code and return coordinates of first matching result
-    for result in onemap_search(zipcode):
+    try:
+        results = onemap_search(zipcode)
+    except OneMapError:
+        return None  # already logged, and there's no older result to fall back on
+
+    for result in results:
         if result.zipcode == zipcode:
+            postal_codes.add(result, replace=True)  # this is the best match for this postal code
             return result
 
 
@@ -0,0 +1,205 @@
+"""
+process-wide rate limiting for upstream apis (e.g. onemap allows 250 calls per minute)
+
+callers that would exceed the rate queue for a while instead of failing,
+and queued calls are let through in priority order, so interactive queries go before background jobs
+"""
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from enum import IntEnum
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # a user is waiting for this
+    BACKGROUND = 1  # warmups, batch jobs, data refreshes
+
+
+class RateLimitExceeded(RuntimeError):
+    pass
+
+
+# the priority for calls made from the current thread (or context), see `TokenBucket.priority`
+_current_priority: contextvars.ContextVar = contextvars.ContextVar('priority', default=Priority.INTERACTIVE)
+
+
+class TokenBucket:
+    """
+    a token bucket that holds up to `capacity` tokens (the max burst size) and refills at `rate` tokens per second
+    each call takes one token, and waits in a priority queue (then FIFO) if there are none left
+    thread-safe
+    """
+
+    def __init__(self,
+                 name: str,
+                 rate: float,
+                 capacity: int,
+                 max_wait: Optional[Dict[Priority, float]] = None,
+                 ):
+        """
+        :param name: for logging
+        :param rate: tokens per second
+        :param capacity: max tokens, i.e. the largest burst allowed
+        :param max_wait: how long each priority can wait in the queue before giving up, in seconds
+        """
+        assert rate > 0, rate
+        assert capacity >= 1, capacity
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.max_wait = {Priority.INTERACTIVE: 10, Priority.BACKGROUND: 60}
+        if max_wait is not None:
+            self.max_wait.update(max_wait)
+
+        self._condition = threading.Condition()
+        self._tokens: float = capacity
+        self._updated: float = time.monotonic()
+        self._queue: List[Tuple[Priority, int]] = []  # heap of waiting calls
+        self._sequence = itertools.count()  # breaks ties, so each priority is FIFO
+
+        # metrics
+        self._calls: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._queued: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._rejected: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._total_wait: Dict[Priority, float] = {priority: 0.0 for priority in Priority}
+        self._max_wait: Dict[Priority, float] = {priority: 0.0 for priority in Priority}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(priority: Priority) -> Iterator[None]:
+        """
+        all rate-limited calls made from this thread inside the `with` block use this priority
+        """
+        reset_token = _current_priority.set(priority)
+        try:
+            yield
+        finally:
+            _current_priority.reset(reset_token)
+
+    @staticmethod
+    def current_priority() -> Priority:
+        return _current_priority.get()
+
+    def acquire(self, priority: Optional[Priority] = None) -> float:
+        """
+        take a token, waiting for one if necessary
+
+        :param priority: defaults to the current priority (see `TokenBucket.priority`)
+        :return: how long we waited, in seconds
+        :raises RateLimitExceeded: if we had to wait more than `max_wait` for this priority
+        """
+        if priority is None:
+            priority = self.current_priority()
+
+        start = time.monotonic()
+        deadline = start + self.max_wait[priority]
+        entry = (priority, next(self._sequence))
+        queued = False
+
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            while True:
+                self._refill()
+
+                # only the head of the queue may take a token, so nothing can jump the queue
+                if self._queue[0] == entry and self._tokens >= 1:
+                    heapq.heappop(self._queue)
+                    self._tokens -= 1
+                    self._condition.notify_all()  # the next in line may be able to go now
+                    break
+
+                now = time.monotonic()
+                if now >= deadline:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._condition.notify_all()  # we might have been the head of the queue
+                    self._rejected[priority] += 1
+                    logging.warning(f'RATE_LIMITED="{self.name}" PRIORITY={priority.name} WAITED={now - start:.3f}')
+                    raise RateLimitExceeded(self.name, priority.name)
+
+                # the head of the queue wakes when the next token is due, everyone else waits to be notified
+                timeout = deadline - now
+                if self._queue[0] == entry:
+                    timeout = min(timeout, (1 - self._tokens) / self.rate)
+                queued = True
+                self._condition.wait(timeout)
+
+            waited = time.monotonic() - start
+            self._calls[priority] += 1
+            self._total_wait[priority] += waited
+            self._max_wait[priority] = max(self._max_wait[priority], waited)
+            if queued:
+                self._queued[priority] += 1
+
+        if waited > 1:
+            logging.info(f'RATE_LIMIT_QUEUED="{self.name}" PRIORITY={priority.name} WAITED={waited:.3f}')
+        return waited
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        """
+        per priority: calls, calls that had to queue, calls rejected, mean and max queueing delay (seconds)
+        plus the current queue length and tokens available
+        """
+        with self._condition:
+            self._refill()
+            out: Dict[str, Dict[str, float]] = {
+                'bucket': {'tokens':       self._tokens,
+                           'queue_length': len(self._queue),
+                           },
+            }
+            for priority in Priority:
+                out[priority.name] = {'calls':     self._calls[priority],
+                                      'queued':    self._queued[priority],
+                                      'rejected':  self._rejected[priority],
+                                      'mean_wait': self._total_wait[priority] / max(1, self._calls[priority]),
+                                      'max_wait':  self._max_wait[priority],
+                                      }
+            return out
+
+
+# onemap allows 250 calls per minute
+# a burst of 25 lets a few concurrent searches through without queueing, and the refill rate is reduced to match,
+# so that no 60 second window can ever have more than 250 calls
+# (onemap calls aren't retried by `transport`, so that retries also go through here, see `_onemap_get`)
+onemap_rate_limiter = TokenBucket('onemap', rate=(250 - 25) / 60, capacity=25)
+
+if __name__ == '__main__':
+    bucket = TokenBucket('test', rate=100, capacity=10, max_wait={Priority.BACKGROUND: 1})
+    order = []
+
+
+    def call(priority, i):
+        with bucket.priority(priority):
+            bucket.acquire()
+        order.append((priority.name, i))
+
+
+    # a background batch drains the bucket, then interactive calls arrive and should go first
+    t = time.time()
+    threads = [threading.Thread(target=call, args=(Priority.BACKGROUND, i)) for i in range(100)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    threads += [threading.Thread(target=call, args=(Priority.INTERACTIVE, i)) for i in range(10)]
+    for thread in threads[100:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('110 calls at 100/s', time.time() - t)
+    print('interactive calls finished at positions',
+          [idx for idx, (name, _) in enumerate(order) if name == 'INTERACTIVE'])
+    print(bucket.metrics())
@@ -0,0 +1,196 @@
+"""
+an on-disk cache in sqlite, so cached api results survive restarts and are shared by every process on the box
+used as the second tier behind the in-memory caches in `api_wrappers.caching`
+
+* WAL mode, so readers don't block the writer (or each other), across processes
+* every entry has its own expiry, and expired entries are never returned
+* once the file is over `max_bytes`, expired entries and then the least recently used entries are evicted
+* values are pickled, then zlib-compressed if that saves space
+"""
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any
+from typing import Hashable
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+_PLAIN = 0
+_ZLIB = 1
+
+
+def _serialize(value: Any) -> Tuple[bytes, int]:
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > 256:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return compressed, _ZLIB
+    return data, _PLAIN
+
+
+def _deserialize(data: bytes, encoding: int) -> Any:
+    if encoding == _ZLIB:
+        data = zlib.decompress(data)
+    return pickle.loads(data)
+
+
+class SqliteCache:
+    """
+    a persistent key-value store with per-entry ttl
+    thread-safe (each thread gets its own connection), and multi-process safe (via sqlite's locking)
+    errors are logged and treated as a cache miss, since the cache is never the only copy of anything
+    """
+
+    def __init__(self,
+                 path: Union[str, Path],
+                 max_bytes: int = 64 * 1024 * 1024,
+                 evict_every: int = 100,
+                 ):
+        """
+        :param path: the database is created on first use
+        :param max_bytes: total size of stored values to evict down to (the file itself will be a bit larger)
+        :param evict_every: check the size every this many writes
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if getattr(self._local, 'connection', None) is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)  # autocommit
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')  # durable enough for a cache
+            connection.execute('CREATE TABLE IF NOT EXISTS cache ('
+                               '    namespace TEXT NOT NULL,'
+                               '    key BLOB NOT NULL,'
+                               '    value BLOB NOT NULL,'
+                               '    encoding INTEGER NOT NULL,'
+                               '    size INTEGER NOT NULL,'
+                               '    created REAL NOT NULL,'
+                               '    expires REAL NOT NULL,'
+                               '    accessed REAL NOT NULL,'
+                               '    PRIMARY KEY (namespace, key)'
+                               ') WITHOUT ROWID')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            self._local.connection = connection
+        return self._local.connection
+
+    @staticmethod
+    def _key(key: Hashable) -> bytes:
+        # the keys are tuples of args, which pickle deterministically for the types we use (str, int, float)
+        return pickle.dumps(key, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def get(self, namespace: str, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """
+        :return: (value, unix timestamp of when it was stored), or None if missing or expired
+        """
+        try:
+            connection = self._connection()
+            now = time.time()
+            row = connection.execute('SELECT value, encoding, created FROM cache '
+                                     'WHERE namespace = ? AND key = ? AND expires > ?',
+                                     (namespace, self._key(key), now)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?',
+                               (now, namespace, self._key(key)))
+            return _deserialize(row[0], row[1]), row[2]
+
+        except Exception as e:
+            logging.warning(f'SQLITE_CACHE_GET_FAILED NAMESPACE="{namespace}" ERROR="{e!r}"')
+            return None
+
+    def set(self, namespace: str, key: Hashable, value: Any, ttl: float, created: Optional[float] = None):
+        """
+        :param ttl: seconds (from `created`) until the entry expires
+        :param created: unix timestamp, defaults to now
+        """
+        if created is None:
+            created = time.time()
+        try:
+            data, encoding = _serialize(value)
+            self._connection().execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                       (namespace, self._key(key), data, encoding, len(data),
+                                        created, created + ttl, time.time()))
+        except Exception as e:
+            logging.warning(f'SQLITE_CACHE_SET_FAILED NAMESPACE="{namespace}" ERROR="{e!r}"')
+            return
+
+        with self._writes_lock:
+            self._writes += 1
+            should_evict = self._writes % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        delete expired entries, then least recently used entries until we're under `max_bytes`
+        """
+        try:
+            connection = self._connection()
+            connection.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+            total_bytes = connection.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+            if total_bytes <= self.max_bytes:
+                return
+
+            # evict down to 90%, so we don't have to do this again on the very next check
+            excess = total_bytes - int(self.max_bytes * 0.9)
+            evicted = 0
+            cutoff = None
+            for accessed, size in connection.execute('SELECT accessed, size FROM cache ORDER BY accessed'):
+                evicted += size
+                cutoff = accessed
+                if evicted >= excess:
+                    break
+            connection.execute('DELETE FROM cache WHERE accessed <= ?', (cutoff,))
+            logging.info(f'SQLITE_CACHE_EVICTED={evicted} TOTAL_BYTES={total_bytes} PATH="{self.path}"')
+
+        except Exception as e:
+            logging.warning(f'SQLITE_CACHE_EVICT_FAILED ERROR="{e!r}"')
+
+    def clear(self, namespace: Optional[str] = None):
+        if namespace is None:
+            self._connection().execute('DELETE FROM cache')
+        else:
+            self._connection().execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+# shared by everything that opts in, see `cache_ttl` and `cache_swr`
+api_cache = SqliteCache('data/api-cache.sqlite3')
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = SqliteCache(Path(temp_dir) / 'test.sqlite3', max_bytes=1024 * 1024)
+
+        t = time.time()
+        for i in range(10000):
+            cache.set('test', (f'query {i}',), [{'ADDRESS': f'{i} SOME ROAD SINGAPORE {i:06d}'}] * 10, ttl=60)
+        print('set x10000', time.time() - t, len(cache))
+
+        t = time.time()
+        for i in range(10000):
+            assert cache.get('test', (f'query {i}',))[0][0]['ADDRESS'].startswith(str(i))
+        print('get x10000', time.time() - t)
+
+        cache.set('test', ('expired',), 1, ttl=-1)
+        assert cache.get('test', ('expired',)) is None
+
+        # evict down to 90% of 1000 bytes
+        cache.max_bytes = 1000
+        cache.evict()
+        print('after evicting', len(cache))
@@ -0,0 +1,180 @@
+"""
+local (vectorized) conversions between the coordinate systems that onemap uses, so we don't need to call the api
+* EPSG:4326 (WGS84 latitude and longitude, in degrees)
+* EPSG:3414 (SVY21 transverse mercator, X is easting and Y is northing, in meters)
+* EPSG:3857 (Google Web Mercator, X is easting and Y is northing, in meters)
+
+SVY21 uses the WGS84 ellipsoid, so there's no datum shift, just the projection
+the transverse mercator uses the krüger series (as in geographiclib) to 3rd order, which is sub-millimeter in singapore
+"""
+import math
+import time
+from typing import Tuple
+
+import numpy as np
+from geographiclib.constants import Constants
+
+# WGS84 ellipsoid
+_a = Constants.WGS84_a
+_f = Constants.WGS84_f
+_e = math.sqrt(_f * (2 - _f))  # first eccentricity
+_n = _f / (2 - _f)  # third flattening
+
+# SVY21 projection parameters
+SVY21_ORIGIN_LATITUDE = 1 + 22 / 60  # 1°22'N
+SVY21_ORIGIN_LONGITUDE = 103 + 50 / 60  # 103°50'E
+SVY21_SCALE_FACTOR = 1.0
+SVY21_FALSE_EASTING = 28001.642  # meters
+SVY21_FALSE_NORTHING = 38744.572  # meters
+
+# krüger series coefficients
+_A = _a / (1 + _n) * (1 + _n ** 2 / 4 + _n ** 4 / 64)  # rectifying radius
+_alpha = (_n / 2 - 2 * _n ** 2 / 3 + 5 * _n ** 3 / 16,
+          13 * _n ** 2 / 48 - 3 * _n ** 3 / 5,
+          61 * _n ** 3 / 240)
+_beta = (_n / 2 - 2 * _n ** 2 / 3 + 37 * _n ** 3 / 96,
+         _n ** 2 / 48 + _n ** 3 / 15,
+         17 * _n ** 3 / 480)
+_delta = (2 * _n - 2 * _n ** 2 / 3 - 2 * _n ** 3,
+          7 * _n ** 2 / 3 - 8 * _n ** 3 / 5,
+          56 * _n ** 3 / 15)
+
+
+def _transverse_mercator(latitudes, longitudes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    unscaled (xi, eta) on the unit sphere, relative to the SVY21 central meridian
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    d_lon = np.radians(np.asarray(longitudes, dtype=float) - SVY21_ORIGIN_LONGITUDE)
+
+    t = np.sinh(np.arctanh(np.sin(lat)) - _e * np.arctanh(_e * np.sin(lat)))  # tan of the conformal latitude
+    xi_prime = np.arctan2(t, np.cos(d_lon))
+    eta_prime = np.arctanh(np.sin(d_lon) / np.sqrt(1 + t ** 2))
+
+    xi = xi_prime.copy()
+    eta = eta_prime.copy()
+    for j, alpha in enumerate(_alpha, start=1):
+        xi += alpha * np.sin(2 * j * xi_prime) * np.cosh(2 * j * eta_prime)
+        eta += alpha * np.cos(2 * j * xi_prime) * np.sinh(2 * j * eta_prime)
+    return xi, eta
+
+
+# meridian arc (as xi) from the equator to the SVY21 origin
+_xi_origin = float(_transverse_mercator(SVY21_ORIGIN_LATITUDE, SVY21_ORIGIN_LONGITUDE)[0])
+
+
+def wgs84_to_svy21(latitudes, longitudes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    EPSG:4326 -> EPSG:3414
+
+    :return: (x, y), ie. (easting, northing) in meters
+    """
+    xi, eta = _transverse_mercator(latitudes, longitudes)
+    x = SVY21_FALSE_EASTING + SVY21_SCALE_FACTOR * _A * eta
+    y = SVY21_FALSE_NORTHING + SVY21_SCALE_FACTOR * _A * (xi - _xi_origin)
+    return x, y
+
+
+def svy21_to_wgs84(xs, ys) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    EPSG:3414 -> EPSG:4326
+
+    :return: (latitudes, longitudes) in degrees
+    """
+    xi = (np.asarray(ys, dtype=float) - SVY21_FALSE_NORTHING) / (SVY21_SCALE_FACTOR * _A) + _xi_origin
+    eta = (np.asarray(xs, dtype=float) - SVY21_FALSE_EASTING) / (SVY21_SCALE_FACTOR * _A)
+
+    xi_prime = xi.copy()
+    eta_prime = eta.copy()
+    for j, beta in enumerate(_beta, start=1):
+        xi_prime -= beta * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        eta_prime -= beta * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+
+    chi = np.arcsin(np.sin(xi_prime) / np.cosh(eta_prime))  # conformal latitude
+    lat = chi.copy()
+    for j, delta in enumerate(_delta, start=1):
+        lat += delta * np.sin(2 * j * chi)
+    lon = np.arctan2(np.sinh(eta_prime), np.cos(xi_prime))
+
+    return np.degrees(lat), SVY21_ORIGIN_LONGITUDE + np.degrees(lon)
+
+
+def wgs84_to_web_mercator(latitudes, longitudes) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    EPSG:4326 -> EPSG:3857
+    web mercator pretends the earth is a sphere with the WGS84 equatorial radius
+
+    :return: (x, y), ie. (easting, northing) in meters
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=float))
+    lon = np.radians(np.asarray(longitudes, dtype=float))
+    return _a * lon, _a * np.log(np.tan(math.pi / 4 + lat / 2))
+
+
+def web_mercator_to_wgs84(xs, ys) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    EPSG:3857 -> EPSG:4326
+
+    :return: (latitudes, longitudes) in degrees
+    """
+    lat = 2 * np.arctan(np.exp(np.asarray(ys, dtype=float) / _a)) - math.pi / 2
+    lon = np.asarray(xs, dtype=float) / _a
+    return np.degrees(lat), np.degrees(lon)
+
+
+_TO_WGS84 = {
+    3414: svy21_to_wgs84,
+    3857: web_mercator_to_wgs84,
+    4326: lambda latitudes, longitudes: (np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)),
+}
+
+_FROM_WGS84 = {
+    3414: wgs84_to_svy21,
+    3857: wgs84_to_web_mercator,
+    4326: lambda latitudes, longitudes: (np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)),
+}
+
+
+def convert(xs_or_latitudes, ys_or_longitudes, input_epsg: int, output_epsg: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    convert between any two of EPSG:4326, EPSG:3414, and EPSG:3857
+    (via WGS84, which is exact since they all use the same datum)
+
+    :param xs_or_latitudes: latitudes for EPSG:4326, otherwise eastings
+    :param ys_or_longitudes: longitudes for EPSG:4326, otherwise northings
+    :return: (latitudes, longitudes) for EPSG:4326, otherwise (eastings, northings)
+    """
+    if input_epsg not in _TO_WGS84:
+        raise ValueError(input_epsg)
+    if output_epsg not in _FROM_WGS84:
+        raise ValueError(output_epsg)
+
+    # pass-through
+    if input_epsg == output_epsg:
+        return np.asarray(xs_or_latitudes, dtype=float), np.asarray(ys_or_longitudes, dtype=float)
+
+    return _FROM_WGS84[output_epsg](*_TO_WGS84[input_epsg](xs_or_latitudes, ys_or_longitudes))
+
+
+if __name__ == '__main__':
+    # the SVY21 origin
+    print(wgs84_to_svy21(SVY21_ORIGIN_LATITUDE, SVY21_ORIGIN_LONGITUDE))
+
+    # round trip across the whole SVY21 area of use
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(1.13, 1.47, 1000000)
+    lons = rng.uniform(103.59, 104.07, 1000000)
+
+    t = time.time()
+    xs, ys = wgs84_to_svy21(lats, lons)
+    print('wgs84 -> svy21 x1000000', time.time() - t)
+
+    t = time.time()
+    lats_2, lons_2 = svy21_to_wgs84(xs, ys)
+    print('svy21 -> wgs84 x1000000', time.time() - t)
+    print('max round trip error (degrees)', max(np.max(np.abs(lats - lats_2)), np.max(np.abs(lons - lons_2))))
+
+    t = time.time()
+    lats_2, lons_2 = convert(*convert(lats, lons, 4326, 3857), 3857, 4326)
+    print('wgs84 -> web mercator -> wgs84 x1000000', time.time() - t)
+    print('max round trip error (degrees)', max(np.max(np.abs(lats - lats_2)), np.max(np.abs(lons - lons_2))))
@@ -0,0 +1,132 @@
+"""
+one shared http session for all the api wrappers, instead of a bare `requests.get` per call
+* keep-alive connection pools per host, so we only pay for the tcp + tls handshake once per connection
+* default (connect, read) timeouts, so a hung upstream can't hang the bot
+* retries with exponential backoff on connection errors and 429/5xx (respecting `Retry-After`)
+* tls verification is on, except for the sg gov apis that have had certificate problems (see `SG_GOV_VERIFY_TLS`)
+
+the session is shared across threads, which is fine since the connection pools are thread-safe
+(and we never mutate the session's cookies or headers after creating it)
+"""
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Optional
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# the default for every call
+VERIFY_TLS = True
+
+# some of the sg gov apis (onemap, nea, data.gov.sg) have served incomplete certificate chains in the past,
+# so the calls to them that have never verified certificates pass `verify=SG_GOV_VERIFY_TLS`
+# set this to True (or a CA bundle path) to turn verification on for those too
+SG_GOV_VERIFY_TLS = False
+
+# (connect, read) in seconds; the data.gov.sg datastore can take a while to respond with large pages
+DEFAULT_TIMEOUT = (3.05, 30)
+
+# per host: how many hosts to keep pools for, and how many connections to keep alive in each pool
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 16
+
+# 3 retries with 0.5s, 1s, 2s backoff (the first retry is immediate in urllib3 < 2)
+RETRY = Retry(total=3,
+              backoff_factor=0.5,
+              status_forcelist=(429, 500, 502, 503, 504),
+              allowed_methods=frozenset({'GET', 'POST'}),  # our POSTs are all read-only queries or token requests
+              raise_on_status=False,  # return the last response and let the caller deal with it
+              )
+
+# calls to these are rate-limited by us (see `api_wrappers.rate_limiting`), so they mustn't be retried down here,
+# where the retries would bypass the rate limiter; the caller retries instead, taking a token for each attempt
+NO_RETRY_URL_PREFIXES = ('https://www.onemap.gov.sg/',)
+
+if not VERIFY_TLS or not SG_GOV_VERIFY_TLS:
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    """
+    the shared session, created on first use
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = requests.Session()
+                _session.verify = VERIFY_TLS
+                adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                      pool_maxsize=POOL_MAXSIZE,
+                                      max_retries=RETRY)
+                _session.mount('http://', adapter)
+                _session.mount('https://', adapter)
+
+                # requests uses the longest matching prefix, so these take precedence
+                no_retry_adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                                               pool_maxsize=POOL_MAXSIZE,
+                                               max_retries=Retry(total=0, raise_on_status=False))
+                for url_prefix in NO_RETRY_URL_PREFIXES:
+                    _session.mount(url_prefix, no_retry_adapter)
+                logging.info(f'HTTP_SESSION_CREATED VERIFY_TLS={VERIFY_TLS} SG_GOV_VERIFY_TLS={SG_GOV_VERIFY_TLS} '
+                             f'TIMEOUT="{DEFAULT_TIMEOUT}"')
+    return _session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    same as `requests.request`, but pooled, with default timeouts, retries, and tls settings
+    """
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    return session().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+if __name__ == '__main__':
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # required for keep-alive
+        disable_nagle_algorithm = True  # otherwise the headers and body are separate packets, and delayed acks add 40ms
+
+        def do_GET(self):
+            body = b'{"results": []}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stub_url = f'http://127.0.0.1:{server.server_address[1]}/api/common/elastic/search'
+
+    for _ in range(3):
+        t = time.time()
+        for _ in range(1000):
+            requests.get(stub_url, params={'searchVal': 'tiong bahru'})
+        print('requests.get x1000', time.time() - t)
+
+        t = time.time()
+        for _ in range(1000):
+            get(stub_url, params={'searchVal': 'tiong bahru'})
+        print('transport.get x1000', time.time() - t)
+
+    server.shutdown()
@@ -7,9 +7,9 @@ from typing import List
 from typing import Optional
 from typing import Tuple
 
-import requests
 from PIL import Image
 
+from api_wrappers import transport
 from api_wrappers.location import Location
 
 intensityColors = [
@@ -47,7 +47,7 @@ intensityColors = [
 
 
 def get_warning():
-    r = requests.get('http://www.weather.gov.sg/mobile/rest-mobile-app-warning/')
+    r = transport.get('http://www.weather.gov.sg/mobile/rest-mobile-app-warning/')
     raise NotImplementedError
 
 
@@ -69,7 +69,7 @@ def get_radar_3rd_party():
 
 
 def get_drain_water_levels():
-    r = requests.get('https://s3-ap-southeast-1.amazonaws.com/myenv2/water_level_card.json')
+    r = transport.get('https://s3-ap-southeast-1.amazonaws.com/myenv2/water_level_card.json')
     raise NotImplementedError
 
 
@@ -77,12 +77,12 @@ def get_lightning():
     # http://www.weather.gov.sg/lightning/lightning/lightningalertinformationsystem.jsp
     # (0.7195858639657194,103.34288130198104), (1.978634136034281,104.60227869801894)
     # url = f'http://www.weather.gov.sg/files/rainarea/50km/dpsri_70km_{timestamp_str}0000dBR.dpsri.png'
-    r = requests.post('http://www.weather.gov.sg/lightning/LightningStrikeServlet/',
-                      json={'lightningType': 'TL'})
-    r = requests.post('http://www.weather.gov.sg/lightning/LightningStrikeServlet/',
-                      json={'lightningType': 'thunderStormForecast'})
-    r = requests.post('http://www.weather.gov.sg/lightning/LightningStrikeServlet/',
-                      json={'lightningType': 'rainRadar'})
+    r = transport.post('http://www.weather.gov.sg/lightning/LightningStrikeServlet/',
+                       json={'lightningType': 'TL'})
+    r = transport.post('http://www.weather.gov.sg/lightning/LightningStrikeServlet/',
+                       json={'lightningType': 'thunderStormForecast'})
+    r = transport.post('http://www.weather.gov.sg/lightning/LightningStrikeServlet/',
+                       json={'lightningType': 'rainRadar'})
     data = json.loads(r.content)
     return data
 
@@ -161,7 +161,7 @@ def get_radar_70km() -> List[List[Tuple[int, int, int, int]]]:
         timestamp_str = timestamp.strftime('%Y%m%d%H%M')
         url = 'http://www.weather.gov.sg/wp-content/themes/wiptheme/assets/img/SG-coastline.png'
         url = f'http://www.weather.gov.sg/files/rainarea/50km/v2/dpsri_70km_{timestamp_str}0000dBR.dpsri.png'
-        r = requests.get(url)
+        r = transport.get(url)
         if r.status_code == 200:
             break
         else:
@@ -190,7 +190,7 @@ def get_radar_240km() -> List[List[Tuple[int, int, int, int]]]:
         timestamp_str = timestamp.strftime('%Y%m%d%H%M')
         print(timestamp_str)
         url = f'http://www.weather.gov.sg/files/rainarea/240km/dpsri_240km_{timestamp_str}0000dBR.dpsri.png'
-        r = requests.get(url)
+        r = transport.get(url)
         if r.status_code == 200:
             break
         else:
@@ -220,7 +220,7 @@ def get_radar_480km() -> List[List[Tuple[int, int, int, int]]]:
         timestamp_str = timestamp.strftime('%Y%m%d%H%M')
         print(timestamp_str)
         url = f'http://www.weather.gov.sg/files/rainarea/480km/dpsri_480km_{timestamp_str}0000dBR.dpsri.png'
-        r = requests.get(url)
+        r = transport.get(url)
         if r.status_code == 200:
             break
         else:
@@ -285,14 +285,14 @@ class WeatherStationVisibility(WeatherStation):
 
 
 def get_img():
-    r = requests.get('http://www.weather.gov.sg/mobile/json/rest-get-latest-observation-for-all-locs.json')
+    r = transport.get('http://www.weather.gov.sg/mobile/json/rest-get-latest-observation-for-all-locs.json')
     data = json.loads(r.content)
 
     rainfall_img_url = data['data']['rainfall_img_url']
-    r = requests.get('http://www.weather.gov.sg/files/isohyet/isohyetmidnight.png')
+    r = transport.get('http://www.weather.gov.sg/files/isohyet/isohyetmidnight.png')
 
     temperature_img_url = data['data']['temp_img_url']
-    r = requests.get('http://www.weather.gov.sg/files/isotherm/isotherm.png')
+    r = transport.get('http://www.weather.gov.sg/files/isotherm/isotherm.png')
 
 
 def _parse_recorded_date(timestamp):
@@ -305,7 +305,7 @@ def _parse_visibility_timestamp(timestamp):
 
 
 def get_weather_readings():
-    r = requests.get('http://www.weather.gov.sg/mobile/json/rest-get-all-climate-stations.json')
+    r = transport.get('http://www.weather.gov.sg/mobile/json/rest-get-all-climate-stations.json')
     data = json.loads(r.content)
     locations = dict()
     for location in data['data']:
@@ -316,7 +316,7 @@ def get_weather_readings():
                                                    )
 
     out = []
-    r = requests.get('n')
+    r = transport.get('n')
     data = json.loads(r.content)
     for station_id, readings in data['data']['station'].items():
         weather_station = locations[station_id]
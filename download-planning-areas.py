@@ -0,0 +1,56 @@
+"""
+download the URA master plan planning area boundaries from onemap, for `utils.load_planning_areas`
+the boundaries only change with a new master plan, so this is run by hand and the output is committed
+"""
+import json
+import sys
+from pathlib import Path
+
+from api_wrappers.onemap_sg_v2 import onemap_planning_areas
+from api_wrappers.rate_limiting import Priority
+from api_wrappers.rate_limiting import onemap_rate_limiter
+from utils import PLANNING_AREAS_PATH
+
+METADATA = '''# Metadata for Planning Areas
+---
+Name: 'planning-areas'
+Title: 'Master Plan {year} Planning Area Boundary'
+Description: 'URA master plan {year} planning area boundaries, one feature per planning area'
+Sources:
+  - 'Urban Redevelopment Authority (via the OneMap getAllPlanningarea api)'
+Source Url: 'https://www.onemap.gov.sg/apidocs/'
+License: 'https://www.onemap.gov.sg/legal/termsofuse.html'
+Format: 'GeoJSON MultiPolygon, coordinates as [longitude, latitude] (WGS84), rounded to 6 decimal places'
+Properties:
+  - 'PLN_AREA_N: planning area name, uppercase'
+'''
+
+
+def _round_coordinates(coordinates):
+    if isinstance(coordinates, (int, float)):
+        return round(coordinates, 6)
+    return [_round_coordinates(x) for x in coordinates]
+
+
+def download_planning_areas(year: int = 2019, path: Path = PLANNING_AREAS_PATH):
+    with onemap_rate_limiter.priority(Priority.BACKGROUND):
+        planning_areas = onemap_planning_areas(year)
+    assert planning_areas, 'no planning areas returned'
+
+    features = [{'type':       'Feature',
+                 'properties': {'PLN_AREA_N': name},
+                 'geometry':   {'type':        geometry['type'],
+                                'coordinates': _round_coordinates(geometry['coordinates']),
+                                },
+                 } for name, geometry in sorted(planning_areas.items())]
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w', encoding='utf8') as f:
+        json.dump({'type': 'FeatureCollection', 'name': f'planning-areas-{year}', 'features': features}, f)
+    with path.with_name(f'metadata-{path.stem}.txt').open('w', encoding='utf8') as f:
+        f.write(METADATA.format(year=year))
+    print(f'saved {len(features)} planning areas to {path}')
+
+
+if __name__ == '__main__':
+    download_planning_areas(int(sys.argv[1]) if len(sys.argv) > 1 else 2019)
@@ -2,6 +2,7 @@ import calendar
 import datetime
 import logging
 import re
+import threading
 import time
 from pathlib import Path
 from pprint import pformat
@@ -11,16 +12,15 @@ from typing import List
 from typing import Optional
 from typing import Tuple
 
-import requests
-
 import config
 import utils
 from api_wrappers.data_gov_sg_v2.weather import Forecast
-from api_wrappers.location import Location
+from api_wrappers.data_gov_sg_v2.weather import weather_24h
 from api_wrappers.data_gov_sg_v2.weather import weather_24h_grouped
 from api_wrappers.data_gov_sg_v2.weather import weather_2h
 from api_wrappers.data_gov_sg_v2.weather import weather_4d
-from api_wrappers.onemap_sg_v2 import onemap_search
+from api_wrappers.location import Location
+from api_wrappers.onemap_sg_v2 import search_address
 from api_wrappers.postal_code import InvalidZip
 from api_wrappers.postal_code import RE_ZIPCODE
 from api_wrappers.postal_code import ZipBlank
@@ -42,17 +42,17 @@ from fastbot.response import Animation
 from hawkers import DateRange
 from hawkers import Hawker
 
-# noinspection PyUnresolvedReferences
-requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
-
 # set up logging appropriately
 utils.setup_logging(app_name='hawker-bot-v2')
 
 # # disable SSL verification
 # utils.no_ssl_verification()
 
-# load hawker center data
-hawker_data = utils.load_hawker_data()
+# load hawker center data (from the last snapshot if possible, it gets refreshed in the background later)
+hawker_data = utils.load_hawker_snapshot()
+hawker_data_is_snapshot = hawker_data is not None
+if not hawker_data_is_snapshot:
+    hawker_data = utils.load_hawker_data()
 
 # create bot
 bot = FastBot(config.SECRETS['hawker_centre_bot_token'])
@@ -85,7 +85,12 @@ def __fix_zip(query: str) -> Tuple[Optional[str], Optional[Markdown]]:
         ]), notification=False)
 
 
-def __search(query: str, threshold=0.6, onemap=False, num_results=3) -> Tuple[List[Hawker], List[Response]]:
+def __search(query: str,
+             threshold=0.6,
+             onemap=False,
+             num_results=3,
+             max_results=25,
+             ) -> Tuple[List[Hawker], List[Response]]:
     if not query:
         logging.info('QUERY_BLANK')
         return [], [Text('no search query received', notification=False)]
@@ -93,7 +98,7 @@ def __search(query: str, threshold=0.6, onemap=False, num_results=3) -> Tuple[Li
     # try exact matched for zip code
     try:
         zip_code = fix_zipcode(query)
-        results = [hawker for hawker in hawker_data if hawker.addresspostalcode == int(zip_code)]
+        results = hawker_data.find_by_postal_code(zip_code)
         if results:
             responses = [Text(f'Displaying postal code matched for "{zip_code}"', notification=False)]
             for result in results:
@@ -103,21 +108,18 @@ def __search(query: str, threshold=0.6, onemap=False, num_results=3) -> Tuple[Li
     except InvalidZip:
         pass
 
-    # try to find exact (case-insensitive) matched for name
-    for hawker in hawker_data:
-        if hawker.name.casefold() == query.casefold():
-            logging.info(f'QUERY_EXACT_MATCH="{query}" RESULT="{hawker.name}"')
-            return [hawker], [Text(f'Displaying exact matched for "{query}"', notification=False),
-                              Markdown(hawker.to_markdown(), notification=False)]
-
-    # run fuzzy search over fields
-    results = sorted([(hawker, hawker.text_similarity(query)) for hawker in hawker_data], key=lambda x: x[1],
-                     reverse=True)
-    results = [result for result in results if result[1] > (threshold, 0)]  # filter out bad matches
+    # try to find exact (normalized) matched for name
+    for hawker in hawker_data.find_by_name(query)[:1]:
+        logging.info(f'QUERY_EXACT_MATCH="{query}" RESULT="{hawker.name}"')
+        return [hawker], [Text(f'Displaying exact matched for "{query}"', notification=False),
+                          Markdown(hawker.to_markdown(), notification=False)]
+
+    # run fuzzy search over fields (filtering out bad matches)
+    results = hawker_data.find_by_text(query, threshold=threshold, limit=max_results)
     if results:
         responses = [Text(f'Displaying top {min(num_results, len(results))} results for "{query}"', notification=False)]
         for hawker, score in results[:num_results]:
-            logging.info(f'QUERY="{query}" SIMILARITY={hawker.text_similarity(query)} RESULT="{hawker.name}"')
+            logging.info(f'QUERY="{query}" SIMILARITY={score} RESULT="{hawker.name}"')
             responses.append(Markdown(hawker.to_markdown(), notification=False))
         return [hawker for hawker, score in results], responses
 
@@ -126,8 +128,8 @@ def __search(query: str, threshold=0.6, onemap=False, num_results=3) -> Tuple[Li
     if not onemap:
         return [], responses
 
-    # if we have don't have to reply, exit early
-    results = onemap_search(query)
+    # if we have don't have to reply, exit early (known buildings are answered locally, without calling onemap)
+    results = search_address(query)
 
     # if we have to reply, try to be a bit more intelligent
     if not results:
@@ -135,7 +137,7 @@ def __search(query: str, threshold=0.6, onemap=False, num_results=3) -> Tuple[Li
         responses.append(Text(f'Zero matches from OneMap.sg for {query}', notification=False))
         return [], responses
 
-    responses.append(Text(f'Displaying top {min(5, len(results))} results from OneMapSG', notification=False))
+    responses.append(Text(f'Displaying top {min(5, len(results))} addresses', notification=False))
 
     lines = []
     for result in results[:5]:
@@ -150,20 +152,28 @@ def __search(query: str, threshold=0.6, onemap=False, num_results=3) -> Tuple[Li
     return [], responses
 
 
+def __retrieved(last_updated: Optional[datetime.datetime]) -> List[str]:
+    """
+    the weather might be an old copy from the cache (e.g. if the api is down), so say how old it is
+    """
+    if last_updated is None or datetime.datetime.now() - last_updated < datetime.timedelta(minutes=5):
+        return []
+    return [f'_(retrieved at {format_datetime(last_updated, use_deictic_temporal_pronouns=True)})_']
+
+
 def __closed(date, date_name) -> Generator[Markdown, Any, None]:
     lines = [f'Closed {date_name}:']
     idx = 0
     yielded = False
 
-    for hawker in sorted(hawker_data, key=lambda x: x.name):
-        if hawker.closed_on_dates(date):
-            idx += 1
-            logging.info(f'CLOSED="{date_name}" DATE="{date}" RESULT="{hawker.name}"')
-            lines.append(f'{idx}.  {hawker.name}')
-            if sum(map(len, lines)) > 3200:
-                yield Markdown('  \n'.join(lines), notification=False)
-                yielded = True
-                lines.clear()
+    for hawker in sorted(hawker_data.closed_on_dates(date), key=lambda x: x.name):
+        idx += 1
+        logging.info(f'CLOSED="{date_name}" DATE="{date}" RESULT="{hawker.name}"')
+        lines.append(f'{idx}.  {hawker.name}')
+        if sum(map(len, lines)) > 3200:
+            yield Markdown('  \n'.join(lines), notification=False)
+            yielded = True
+            lines.clear()
     if len(lines) > 1 or yielded:
         yield Markdown('  \n'.join(lines), notification=False)
     else:
@@ -173,10 +183,9 @@ def __closed(date, date_name) -> Generator[Markdown, Any, None]:
 
 def __nearby(loc, num_results=3):
     assert isinstance(loc, Location), loc
-    # noinspection PyTypeChecker
-    results: List[Hawker] = loc.k_nearest(hawker_data, k=-1)
+    results = hawker_data.find_by_location(loc, k=num_results)
     responses = []
-    for result in results[:num_results]:
+    for result in results:
         logging.info(f'LAT={loc.latitude} LON={loc.longitude} DISTANCE={loc.distance(result)} RESULT="{result.name}"')
         responses.append(Markdown(f'{round(loc.distance(result))} meters away:  \n{result.to_markdown()}',
                                   notification=False))
@@ -254,7 +263,7 @@ def cmd_onemap(message: Message):
         ]), notification=False)
         return
 
-    results = onemap_search(query)
+    results = search_address(query)
     if not results:
         logging.info(f'QUERY_ONEMAP_NO_RESULTS="{query}"')
         yield Text(f'No results for {query}',
@@ -262,7 +271,7 @@ def cmd_onemap(message: Message):
         return
 
     logging.info(f'QUERY_ONEMAP="{query}" NUM_RESULTS={len(results)}')
-    yield Text(f'Displaying top {min(10, len(results))} results from OneMapSG',
+    yield Text(f'Displaying top {min(10, len(results))} addresses',
                notification=False)
 
     out = []
@@ -314,6 +323,7 @@ def cmd_zip(message: Message):
         yield Markdown('  \n'.join([
             f'*Weather near your postal code ({forecast.name} Area)*',
             f'{format_datetime(forecast.time_start)} to {format_datetime(forecast.time_end)}: {forecast.forecast}',
+            *__retrieved(weather_2h.last_updated()),
         ]), notification=False, web_page_preview=False)
 
     except KeyError:
@@ -346,7 +356,7 @@ def cmd_near(message: Message):
         yield Text('You seem to be looking for hawker_data near your current location. '
                    'If so, please send your location.')
 
-    results = onemap_search(query)
+    results = search_address(query)
     if not results:
         logging.info(f'QUERY_NEAR_NO_RESULTS="{query}"')
         yield Text(f'No results for {query}', notification=False)
@@ -360,7 +370,7 @@ def cmd_near(message: Message):
         else:
             return
 
-        results = onemap_search(query)
+        results = search_address(query)
         if not results:
             logging.info(f'QUERY_NEAR_RETRY_NO_RESULTS="{query}"')
             return
@@ -390,6 +400,7 @@ def cmd_weather():
             lines = [f'*Weather forecast from {start_str} to {end_str}*']
             for forecast in weather_data[time_start, time_end]:
                 lines.append(f'{forecast.name}: {forecast.forecast}')
+            lines.extend(__retrieved(weather_24h.last_updated()))
 
             # send message
             yield Markdown('  \n'.join(lines), notification=False, web_page_preview=False)
@@ -410,7 +421,7 @@ def cmd_list():
     idx = 0
 
     logging.info(f'LIST_ALL')
-    for hawker in sorted(hawker_data, key=lambda x: x.name):
+    for hawker in hawker_data.sorted_by_name():
         idx += 1
         lines.append(f'{idx}.  {hawker.name}')
         if sum(map(len, lines)) > 3200:
@@ -436,6 +447,7 @@ def cmd_today():
                 lines = [f'*Weather forecast from {start_str} to {end_str}*']
                 for forecast in forecasts:
                     lines.append(f'{forecast.name}: {forecast.forecast}')
+                lines.extend(__retrieved(weather_24h.last_updated()))
 
                 # send message
                 yield Markdown('  \n'.join(lines), notification=False, web_page_preview=False)
@@ -460,6 +472,7 @@ def cmd_tomorrow():
                 yield Markdown('  \n'.join([
                     f'*Weather forecast for tomorrow, {format_date(tomorrow, print_day=True)}:*',
                     _forecast.forecast,
+                    *__retrieved(weather_4d.last_updated()),
                 ]), notification=False, web_page_preview=False)
                 break
 
@@ -564,7 +577,7 @@ def cmd_ping():
 @bot.command('update')
 def cmd_update():
     global hawker_data
-    prev_data = hawker_data[:]
+    prev_data = hawker_data
 
     hawker_data = utils.load_hawker_data()
     yield Text(f'updated to dataset published on {utils.last_loaded_date.strftime("%Y-%m-%d %H:%M:%S")}',
@@ -621,7 +634,7 @@ def handle_location(message: Message):
                    longitude=message.update.effective_message.location.longitude,
                    )
 
-    # outside the SVY21 bounding box
+    # outside singapore (including territorial waters)
     if not loc.within_singapore():
         yield Text('You appear to be outside of Singapore, so this bot will probably not be very useful to you',
                    notification=False)
@@ -629,11 +642,11 @@ def handle_location(message: Message):
     try:
         # noinspection PyTypeChecker
         forecast: Forecast = loc.nearest(weather_2h())
-        yield Markdown(f'*Weather near you ({forecast.name})*  \n'
-                       f'{format_datetime(forecast.time_start)} to {format_datetime(forecast.time_end)}: '
-                       f'{forecast.forecast}',
-                       notification=False,
-                       web_page_preview=False)
+        yield Markdown('  \n'.join([
+            f'*Weather near you ({forecast.name})*',
+            f'{format_datetime(forecast.time_start)} to {format_datetime(forecast.time_end)}: {forecast.forecast}',
+            *__retrieved(weather_2h.last_updated()),
+        ]), notification=False, web_page_preview=False)
 
     except KeyError:
         yield Markdown('The `data.gov.sg` weather API is not responding')
@@ -668,7 +681,7 @@ def handle_inline(message: InlineQuery) -> None:
     query = message.text
     logging.info(f'INLINE="{query}"')
 
-    results, responses = __search(query)
+    results, responses = __search(query, max_results=5)
     if results:
         for hawker in results[:5]:
             yield InlineVenue(title=hawker.name,
@@ -688,4 +701,6 @@ def handle_inline(message: InlineQuery) -> None:
 
 
 if __name__ == '__main__':
+    if hawker_data_is_snapshot:
+        threading.Thread(target=lambda: list(cmd_update()), name='refresh-hawker-data', daemon=True).start()
     bot.run_forever(lambda: list(cmd_update()), delay=12*60*60)
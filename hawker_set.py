@@ -0,0 +1,142 @@
+import datetime
+import re
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+import pandas as pd
+
+from api_wrappers.location import Location
+from api_wrappers.location import LocationIndex
+from api_wrappers.location import NearestTileTable
+from api_wrappers.polygons import PolygonRegions
+from hawker_table import HawkerTable
+from hawkers import ClosureCalendar
+from hawkers import DateRange
+from hawkers import Hawker
+from hawkers import HawkerTextIndex
+from hawkers import normalize_hawker_center_name
+
+
+def normalize_area_name(name: str) -> str:
+    """
+    case, spaces, and punctuation don't matter, eg. 'ang mo kio' == 'ANG MO KIO' == 'Ang-Mo-Kio'
+    """
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', name.casefold()).split())
+
+
+class HawkerSet:
+    """
+    all the hawker centres from one dataset load, plus every index needed to look them up
+    the hawkers must not be modified after the set is built, or the indexes will be out of date
+
+    * postal code, normalized name, and address are hash lookups
+    * location lookups use precomputed tiles (see `NearestTileTable`), or a kd-tree (see `LocationIndex`)
+    * fuzzy text lookups use an inverted bigram index (see `HawkerTextIndex`)
+    * closure lookups use a per-day bitset (see `ClosureCalendar`)
+    * planning area lookups are precomputed lists (if the planning area polygons were provided)
+    """
+
+    def __init__(self, hawkers: Iterable[Hawker], planning_areas: Optional[PolygonRegions] = None):
+        self.hawkers: List[Hawker] = list(hawkers)
+
+        self._by_postal_code: Dict[int, List[Hawker]] = dict()
+        self._by_name: Dict[str, List[Hawker]] = dict()
+        self._by_address: Dict[str, List[Hawker]] = dict()
+        for hawker in self.hawkers:
+            if not pd.isna(hawker.addresspostalcode):
+                self._by_postal_code.setdefault(int(hawker.addresspostalcode), []).append(hawker)
+            self._by_name.setdefault(normalize_hawker_center_name(hawker.name), []).append(hawker)
+            if hawker.address_myenv is not None:
+                self._by_address.setdefault(hawker.address_myenv, []).append(hawker)
+
+        # planning area membership is computed once here, so the polygons aren't needed after this
+        self._planning_area_names: Dict[str, str] = dict()  # normalized name -> name
+        self._by_planning_area: Dict[str, List[Hawker]] = dict()
+        if planning_areas is not None:
+            for name in planning_areas.names:
+                self._planning_area_names[normalize_area_name(name)] = name
+                self._by_planning_area[normalize_area_name(name)] = []
+            for hawker, name in zip(self.hawkers,
+                                    planning_areas.regions_of_many([hawker.longitude for hawker in self.hawkers],
+                                                                   [hawker.latitude for hawker in self.hawkers])):
+                if name is not None:
+                    self._by_planning_area[normalize_area_name(name)].append(hawker)
+
+        self.table = HawkerTable(self.hawkers)
+        self.location_index = LocationIndex(self.hawkers)
+        self.nearest_tiles = NearestTileTable(self.location_index)
+        self.text_index = HawkerTextIndex(self.hawkers)
+        self.closure_calendar = ClosureCalendar(self.hawkers)
+
+    def __len__(self) -> int:
+        return len(self.hawkers)
+
+    def __iter__(self) -> Iterator[Hawker]:
+        return iter(self.hawkers)
+
+    def __getitem__(self, idx: int) -> Hawker:
+        return self.hawkers[idx]
+
+    def find_by_postal_code(self, postal_code: Union[int, str]) -> List[Hawker]:
+        return list(self._by_postal_code.get(int(postal_code), []))
+
+    def find_by_name(self, name: str) -> List[Hawker]:
+        """
+        exact match after normalizing (see `normalize_hawker_center_name`)
+        """
+        return list(self._by_name.get(normalize_hawker_center_name(name), []))
+
+    def find_by_address(self, address: str) -> List[Hawker]:
+        """
+        exact match on `address_myenv`
+        """
+        return list(self._by_address.get(address, []))
+
+    def find_by_location(self, location: Location, k: int = 3) -> List[Hawker]:
+        """
+        nearest k hawkers (or fewer, if there aren't that many)
+        """
+        if not self.hawkers:
+            return []
+        # noinspection PyTypeChecker
+        return self.nearest_tiles.k_nearest(location, min(k, len(self.hawkers)))
+
+    def find_within_radius(self, location: Location, meters: float) -> List[Hawker]:
+        # noinspection PyTypeChecker
+        return self.location_index.within_radius(location, meters)
+
+    def find_by_text(self,
+                     text: str,
+                     threshold: float = 0.0,
+                     limit: Optional[int] = None,
+                     ) -> List[Tuple[Hawker, Tuple[float, float]]]:
+        """
+        fuzzy match, see `Hawker.text_similarity`
+        """
+        return self.text_index.search(text, threshold=threshold, limit=limit)
+
+    def planning_area_name(self, name: str) -> Optional[str]:
+        """
+        the official name of a planning area (eg. 'ANG MO KIO' for 'ang-mo-kio'), or None if there is no such area
+        """
+        return self._planning_area_names.get(normalize_area_name(name))
+
+    def find_by_planning_area(self, name: str) -> Optional[List[Hawker]]:
+        """
+        all hawkers in a URA planning area (e.g. 'Clementi'), sorted by name
+        returns None if there is no such planning area, or an empty list if there are no hawkers in it
+        """
+        if normalize_area_name(name) not in self._by_planning_area:
+            return None
+        return sorted(self._by_planning_area[normalize_area_name(name)], key=lambda hawker: hawker.name)
+
+    def closed_on_dates(self, *dates: Union[DateRange, datetime.date]) -> List[Hawker]:
+        return self.closure_calendar.closed_on_dates(*dates)
+
+    def sorted_by_name(self) -> List[Hawker]:
+        return self.table.rows(self.table.sorted_by_name())
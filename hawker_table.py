@@ -0,0 +1,73 @@
+import sys
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from hawkers import Hawker
+
+
+def _intern(text: Optional[str]) -> Optional[str]:
+    return sys.intern(text) if text is not None else None
+
+
+class HawkerTable:
+    """
+    columnar copy of a list of hawkers, built once per dataset load
+    the rows handed out are the original Hawker objects, so `to_markdown` and `to_json` work as usual
+
+    only holds what `HawkerSet` actually queries (the other lookups have their own indices in `HawkerSet`)
+    """
+
+    def __init__(self, hawkers: Iterable[Hawker]):
+        self.hawkers: List[Hawker] = list(hawkers)
+
+        # interned string columns
+        self.name = np.array([_intern(hawker.name) for hawker in self.hawkers], dtype=object)
+        self._name_order = np.argsort(self.name, kind='stable')
+
+    def __len__(self) -> int:
+        return len(self.hawkers)
+
+    def __iter__(self) -> Iterator[Hawker]:
+        return iter(self.hawkers)
+
+    def __getitem__(self, idx: int) -> Hawker:
+        return self.hawkers[idx]
+
+    def rows(self, idxs: Iterable[int]) -> List[Hawker]:
+        return [self.hawkers[idx] for idx in idxs]
+
+    def sorted_by_name(self, idxs: Optional[Iterable[int]] = None) -> np.ndarray:
+        """
+        all rows (or just the rows provided) sorted by name
+        """
+        if idxs is None:
+            return self._name_order
+        idxs = np.asarray(list(idxs), dtype=np.int64)
+        return idxs[np.argsort(self.name[idxs], kind='stable')]
+
+
+if __name__ == '__main__':
+    df = pd.read_csv('data/hawker-centres/hawker-centres.csv')
+    hawkers = Hawker.from_dataframe(df)
+
+    t = time.time()
+    table = HawkerTable(hawkers)
+    print('build table', time.time() - t)
+
+    assert table.rows(table.sorted_by_name()) == sorted(hawkers, key=lambda hawker: hawker.name)
+
+    t = time.time()
+    for _ in range(1000):
+        table.rows(table.sorted_by_name())
+    print('presorted', time.time() - t)
+
+    t = time.time()
+    for _ in range(1000):
+        sorted(hawkers, key=lambda hawker: hawker.name)
+    print('sorted', time.time() - t)
@@ -1,34 +1,67 @@
+import bisect
 import datetime
 import logging
+import time
+from collections import Counter
 from dataclasses import dataclass
 from dataclasses import field
 from enum import Enum
 from enum import auto
 from enum import unique
+from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Set
 from typing import Tuple
 from typing import Union
 
+import numpy as np
 import pandas as pd
 from geographiclib.constants import Constants
 from geographiclib.geodesic import Geodesic
 from nmd.nmd_bow import bow_ngram_movers_distance
 
+from api_wrappers.location import APPROXIMATE_DISTANCE_ERROR
 from api_wrappers.location import Location
+from api_wrappers.location import haversine_distances
+from api_wrappers.location import within_singapore
 from api_wrappers.string_formatting import format_date
 from tokenizer import unicode_tokenize
 
 WGS84 = Geodesic(Constants.WGS84_a, Constants.WGS84_f)
 
 
-def text_similarity(text_1: str, text_2: str) -> float:
-    return bow_ngram_movers_distance(bag_of_words_1=unicode_tokenize(text_1.lower(), words_only=True),
-                                     bag_of_words_2=unicode_tokenize(text_2.lower(), words_only=True),
+def tokenize(text: str) -> Tuple[str, ...]:
+    """
+    the (lowercased) bag of words used for similarity scoring
+    """
+    return tuple(unicode_tokenize(text.lower(), words_only=True))
+
+
+def words_similarity(words_1: Sequence[str], words_2: Sequence[str]) -> float:
+    """
+    same as `text_similarity`, but for text that has already been tokenized
+    """
+    return bow_ngram_movers_distance(bag_of_words_1=words_1,
+                                     bag_of_words_2=words_2,
                                      invert=True,
                                      )
 
 
+def text_similarity(text_1: str, text_2: str) -> float:
+    return words_similarity(tokenize(text_1), tokenize(text_2))
+
+
+def normalize_hawker_center_name(name):
+    name = f' {name.casefold()} '
+    name = name.replace('&', ' and ')
+    name = name.replace('@', ' at ')
+    name = name.replace(' the ', ' ')
+    return ' '.join(name.split())
+
+
 @dataclass(order=True)
 class DateRange:
     start: datetime.date  # inclusive
@@ -136,9 +169,17 @@ class Hawker(Location):
 
     other_works_period: Optional[DateRange] = None
 
+    # tokenized name, address_myenv, and addressbuildingname (if not None) for `text_similarity`
+    text_fields: List[Tuple[str, ...]] = field(default_factory=list, init=False, repr=False, compare=False)
+
+    # cached output of `to_markdown`, split into the part that never changes and the part that changes daily
+    _markdown_static: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    _markdown_daily: Optional[Tuple[datetime.date, str]] = field(default=None, init=False, repr=False, compare=False)
+
     def __post_init__(self):
-        if self.location_hc and self.distance(self.location_hc) > 160:  # worst offender currently 154 meters
-            logging.warning(f'hawker center {self.name} is {self.distance(self.location_hc)} meters away from itself')
+        for self_text in [self.name, self.address_myenv, self.addressbuildingname]:  # , self.description_myenv]:
+            if self_text is not None:
+                self.text_fields.append(tokenize(self_text))
 
     @property
     def location_hc(self):
@@ -152,7 +193,7 @@ class Hawker(Location):
             if pd.isna(value):
                 dataframe_row[key] = None
 
-        return Hawker(name=dataframe_row['NAME'],
+        hawker = Hawker(name=dataframe_row['NAME'],
                       latitude=float(dataframe_row['point_lat']),
                       longitude=float(dataframe_row['point_lon']),
                       latitude_hc=float(dataframe_row['LATITUDE']) if dataframe_row['LATITUDE'] else None,
@@ -171,8 +212,55 @@ class Hawker(Location):
                       rnr_status=dataframe_row['RNR_STATUS'],
                       est_original_completion_date=dataframe_row['EST_ORIGINAL_COMPLETION_DATE'],
                       )
+        check_locations([hawker])
+        return hawker
+
+    @staticmethod
+    def from_dataframe(dataframe: pd.DataFrame) -> List['Hawker']:
+        """
+        same as calling `from_row` on every row, but each column is converted once instead of once per row
+        """
+        columns = dict(name=_column_values(dataframe['NAME']),
+                       latitude=pd.to_numeric(dataframe['point_lat']).astype(float).tolist(),
+                       longitude=pd.to_numeric(dataframe['point_lon']).astype(float).tolist(),
+                       latitude_hc=_column_values(_nonzero(dataframe['LATITUDE'])),
+                       longitude_hc=_column_values(_nonzero(dataframe['LONGITUDE'])),
+                       status=[status_map[status] for status in _column_values(dataframe['STATUS'])],
+                       address_myenv=_column_values(dataframe['ADDRESS_MYENV']),
+                       description_myenv=_column_values(dataframe['DESCRIPTION_MYENV']),
+                       addressblockhousenumber=_column_values(dataframe['ADDRESSBLOCKHOUSENUMBER']),
+                       addressstreetname=_column_values(dataframe['ADDRESSSTREETNAME']),
+                       addressbuildingname=_column_values(dataframe['ADDRESSBUILDINGNAME']),
+                       addresspostalcode=_column_values(dataframe['ADDRESSPOSTALCODE']),
+                       region=_column_values(dataframe['REGION']),
+                       photourl=_column_values(dataframe['PHOTOURL']),
+                       no_of_food_stalls=pd.to_numeric(dataframe['NO_OF_FOOD_STALLS'])
+                       .fillna(0).astype(int).tolist(),
+                       no_of_market_stalls=pd.to_numeric(dataframe['NO_OF_MARKET_STALLS'])
+                       .fillna(0).astype(int).tolist(),
+                       rnr_status=_column_values(dataframe['RNR_STATUS']),
+                       est_original_completion_date=_column_values(dataframe['EST_ORIGINAL_COMPLETION_DATE']),
+                       )
+
+        hawkers = [Hawker(**dict(zip(columns.keys(), values))) for values in zip(*columns.values())]
+        check_locations(hawkers)
+        return hawkers
+
+    def add_closures(self, cleaning_date_ranges: Iterable[DateRange], other_works_period: Optional[DateRange]):
+        """
+        same as `add_cleaning_periods`, but with dates that were already parsed by `closure_periods_from_dataframe`
+        """
+        # closure dates are part of the rendered markdown
+        self._markdown_daily = None
+
+        self.cleaning_date_ranges.extend(cleaning_date_ranges)
+        if other_works_period is not None:
+            self.other_works_period = other_works_period
 
     def add_cleaning_periods(self, dataframe_row):
+        # closure dates are part of the rendered markdown
+        self._markdown_daily = None
+
         # handle nan
         for key, value in dataframe_row.items():
             if pd.isna(value):
@@ -225,55 +313,57 @@ class Hawker(Location):
         return int(year)
 
     @property
-    def closure_dates(self) -> List[datetime.date]:
-        out = set()
+    def closure_date_ranges(self) -> List[DateRange]:
+        out = []
         if self.rnr_period:
-            out.update(self.rnr_period.dates)
+            out.append(self.rnr_period)
         if self.other_works_period:
-            out.update(self.other_works_period.dates)
-        for date_range in self.cleaning_date_ranges:
+            out.append(self.other_works_period)
+        out.extend(self.cleaning_date_ranges)
+        return out
+
+    @property
+    def closure_dates(self) -> List[datetime.date]:
+        out = set()
+        for date_range in self.closure_date_ranges:
             out.update(date_range.dates)
         return sorted(out)
 
     def closed_on_dates(self, *dates: Union[DateRange, datetime.date]):
-        closed_dates = set(self.closure_dates)
+        closure_date_ranges = self.closure_date_ranges
         for date in dates:
-            if isinstance(date, DateRange):
-                for _date in date.dates:
-                    if _date in closed_dates:
-                        return True
-                continue
-
-            if isinstance(date, datetime.datetime):
-                date = date.date()
-
-            assert isinstance(date, datetime.date)
-            if date in closed_dates:
-                return True
+            start, end = ordinal_range(date)
+            for date_range in closure_date_ranges:
+                if date_range.start.toordinal() <= end and start <= date_range.end.toordinal():
+                    return True
 
         return False
 
     def text_similarity(self, text: str) -> Tuple[float, float]:
-        results = []
-        for self_text in [self.name, self.address_myenv, self.addressbuildingname]:  # , self.description_myenv]:
-            if self_text is not None:
-                results.append(text_similarity(text, self_text))
+        return self.words_similarity(tokenize(text))
+
+    def words_similarity(self, words: Sequence[str]) -> Tuple[float, float]:
+        """
+        same as `text_similarity`, but takes an already-tokenized query, so it only needs to be tokenized once
+        """
+        results = [words_similarity(words, self_words) for self_words in self.text_fields]
         if not results:
             return 0.0, 0.0
         return max(results), sum(results)
 
     def to_markdown(self) -> str:
+        """
+        the rendered card is cached on the object, since it only changes when the dataset is reloaded
+        (which creates new Hawker objects) or when the date changes (which is part of the cache key)
+        """
+        today = datetime.date.today()
+        if self._markdown_static is None:
+            self._markdown_static = self._render_static_markdown()
+        if self._markdown_daily is None or self._markdown_daily[0] != today:
+            self._markdown_daily = (today, self._render_daily_markdown(today))
+        return f'{self._markdown_static}  \n{self._markdown_daily[1]}'
 
-        # closure dates
-        closed_dates = []
-        for date_range in self.cleaning_date_ranges:
-            closed_dates.append((date_range, f'{date_range.month_name} cleaning'))
-        if self.rnr_period:
-            closed_dates.append((self.rnr_period, f'{self.rnr_period.month_name} renovation'))
-        if self.other_works_period and self.other_works_period != self.rnr_period:
-            closed_dates.append((self.other_works_period, f'{self.other_works_period.month_name} other works'))
-        closed_dates = sorted(closed_dates)
-
+    def _render_static_markdown(self) -> str:
         # output markdown lines
         lines = []
 
@@ -303,9 +393,26 @@ class Hawker(Location):
         if self.addressbuildingname:
             lines.append(f'(located in {self.addressbuildingname})')
 
+        # done, now join the lines into a single message
+        return '  \n'.join(lines)
+
+    def _render_daily_markdown(self, today: datetime.date) -> str:
+        # closure dates
+        closed_dates = []
+        for date_range in self.cleaning_date_ranges:
+            closed_dates.append((date_range, f'{date_range.month_name} cleaning'))
+        if self.rnr_period:
+            closed_dates.append((self.rnr_period, f'{self.rnr_period.month_name} renovation'))
+        if self.other_works_period and self.other_works_period != self.rnr_period:
+            closed_dates.append((self.other_works_period, f'{self.other_works_period.month_name} other works'))
+        closed_dates = sorted(closed_dates)
+
+        # output markdown lines
+        lines = []
+
         # closure reason(s)
         for date_range, reason in closed_dates:
-            if datetime.date.today() in date_range.dates:
+            if date_range.start <= today <= date_range.end:
                 lines.append(f'(Closed for {reason})')
                 break
         else:
@@ -315,7 +422,7 @@ class Hawker(Location):
         if closed_dates:
             for date_range, reason in closed_dates:
                 lines.append(f'{reason}: {str(date_range)}')
-        elif self.estimated_original_completion_date > datetime.datetime.today():
+        elif self.estimated_original_completion_date > datetime.datetime.combine(today, datetime.time()):
             if len(self.est_original_completion_date) == 4:
                 lines.append(f'Opening in {self.est_original_completion_date}')
             else:
@@ -354,6 +461,253 @@ class Hawker(Location):
         }
 
 
+def _column_values(column: pd.Series) -> list:
+    """
+    values of a dataframe column as python objects, with nan replaced by None
+    """
+    column = column.astype(object)
+    return column.where(column.notna(), None).tolist()
+
+
+def _nonzero(column: pd.Series) -> pd.Series:
+    """
+    numeric column with zeroes (and anything non-numeric) replaced by nan
+    """
+    column = pd.to_numeric(column, errors='coerce').astype(float)
+    return column.where(column != 0)
+
+
+def check_locations(hawkers: Sequence[Hawker], max_distance: float = 160):
+    """
+    warn about hawkers that are not in singapore,
+    or whose `location_hc` is too far from their location (worst offender currently 154 meters)
+    haversine is close to vincenty, so only the hawkers close to the limit need to be checked with vincenty
+    """
+    in_singapore = within_singapore([hawker.latitude for hawker in hawkers], [hawker.longitude for hawker in hawkers])
+    for idx in np.flatnonzero(~in_singapore):
+        logging.warning(f'hawker center {hawkers[idx].name} is not in singapore')
+
+    idxs = [idx for idx, hawker in enumerate(hawkers) if hawker.location_hc]
+    if not idxs:
+        return
+    distances = haversine_distances([hawkers[idx].latitude for idx in idxs],
+                                    [hawkers[idx].longitude for idx in idxs],
+                                    [hawkers[idx].latitude_hc for idx in idxs],
+                                    [hawkers[idx].longitude_hc for idx in idxs])
+    for idx in np.flatnonzero(distances > max_distance * (1 - APPROXIMATE_DISTANCE_ERROR)):
+        hawker = hawkers[idxs[idx]]
+        if hawker.distance(hawker.location_hc, exact=True) > max_distance:
+            logging.warning(f'hawker center {hawker.name} is {hawker.distance(hawker.location_hc)} meters away '
+                            f'from itself')
+
+
+def _parse_dates(column: pd.Series) -> List[Optional[datetime.date]]:
+    """
+    parse a whole column of '%d/%m/%Y' dates at once, anything unparseable becomes None
+    """
+    parsed = pd.to_datetime(column.astype(object), format='%d/%m/%Y', errors='coerce')
+    return [None if pd.isna(timestamp) else timestamp.date() for timestamp in parsed]
+
+
+def closure_periods_from_dataframe(dataframe: pd.DataFrame,
+                                   ) -> List[Tuple[List[DateRange], Optional[DateRange]]]:
+    """
+    same dates as calling `Hawker.add_cleaning_periods` on every row, but parsed a column at a time
+    :return: (cleaning date ranges, other works period) for each row, to be passed to `Hawker.add_closures`
+    """
+    cleaning_date_ranges = [[] for _ in range(len(dataframe))]
+    for q in ['q1', 'q2', 'q3', 'q4']:
+        starts = _parse_dates(dataframe[f'{q}_cleaningstartdate'])
+        ends = _parse_dates(dataframe[f'{q}_cleaningenddate'])
+        for date_ranges, start, end in zip(cleaning_date_ranges, starts, ends):
+            if start is not None and end is not None:
+                date_ranges.append(DateRange(start, end))
+
+    other_works_periods = [DateRange(start, end) if start is not None and end is not None else None
+                           for start, end in zip(_parse_dates(dataframe['other_works_startdate']),
+                                                 _parse_dates(dataframe['other_works_enddate']))]
+
+    return list(zip(cleaning_date_ranges, other_works_periods))
+
+
+def ordinal_range(date: Union[DateRange, datetime.date]) -> Tuple[int, int]:
+    """
+    inclusive (start, end) day ordinals of a date or a DateRange
+    """
+    if isinstance(date, DateRange):
+        return date.start.toordinal(), date.end.toordinal()
+
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+
+    assert isinstance(date, datetime.date)
+    return date.toordinal(), date.toordinal()
+
+
+def closure_intervals(hawker: Hawker) -> List[Tuple[int, int]]:
+    """
+    sorted and merged inclusive (start, end) day ordinals of all the hawker's closures
+    """
+    intervals = []
+    for start, end in sorted(ordinal_range(date_range) for date_range in hawker.closure_date_ranges):
+        if intervals and start <= intervals[-1][1] + 1:
+            intervals[-1] = (intervals[-1][0], max(end, intervals[-1][1]))
+        else:
+            intervals.append((start, end))
+    return intervals
+
+
+class ClosureCalendar:
+    """
+    index of which hawkers are closed on which days, built once per dataset load
+    the hawkers must not be modified after the calendar is built, or the calendar will be out of date
+
+    stores a bitset of closed hawkers for every day that has any closure at all (keyed by day ordinal)
+    so checking a date range is an OR over the closed days in that range, instead of expanding every DateRange
+    """
+
+    def __init__(self, hawkers: Iterable[Hawker]):
+        self.hawkers: List[Hawker] = list(hawkers)
+
+        # merged (start, end) ordinal intervals per hawker
+        self.intervals: List[List[Tuple[int, int]]] = [closure_intervals(hawker) for hawker in self.hawkers]
+
+        # day ordinal -> hawker bitset
+        self._closed_bits: Dict[int, int] = dict()
+        for idx, intervals in enumerate(self.intervals):
+            for start, end in intervals:
+                for ordinal in range(start, end + 1):
+                    self._closed_bits[ordinal] = self._closed_bits.get(ordinal, 0) | (1 << idx)
+        self._ordinals: List[int] = sorted(self._closed_bits)
+
+    def closed_bits(self, *dates: Union[DateRange, datetime.date]) -> int:
+        """
+        bitset of hawkers (by index) closed on any day of any of the dates provided
+        """
+        bits = 0
+        for date in dates:
+            start, end = ordinal_range(date)
+            for ordinal in self._ordinals[bisect.bisect_left(self._ordinals, start):
+                                          bisect.bisect_right(self._ordinals, end)]:
+                bits |= self._closed_bits[ordinal]
+        return bits
+
+    def closed_on_dates(self, *dates: Union[DateRange, datetime.date]) -> List[Hawker]:
+        """
+        hawkers closed on any day of any of the dates provided, in the same order as they were given
+        """
+        bits = self.closed_bits(*dates)
+        return [hawker for idx, hawker in enumerate(self.hawkers) if bits >> idx & 1]
+
+
+def _bigram_counts(word: str) -> Counter:
+    """
+    same padded character bigrams that `bow_ngram_movers_distance` uses internally (with n=2)
+    """
+    padded = f'\2{word}\3'
+    return Counter(padded[idx:idx + 2] for idx in range(len(padded) - 1))
+
+
+# the float bounds can round to slightly below the true score, so pruning allows for this much error
+# otherwise a hawker whose score ties with the threshold (or the kth best result) could be skipped
+_BOUND_SLACK = 1e-9
+
+
+class HawkerTextIndex:
+    """
+    inverted character-bigram index over the hawker fields used by `Hawker.text_similarity`, built once per load
+
+    nmd between two words can't be more than their bigram overlap (dice coefficient), so the overlap gives a cheap
+    upper bound on each hawker's similarity score, and the expensive nmd only needs to run on the hawkers whose
+    upper bound could still beat the results found so far
+    """
+
+    def __init__(self, hawkers: Iterable[Hawker]):
+        self.hawkers: List[Hawker] = list(hawkers)
+
+        self._word_ids: Dict[str, int] = dict()
+        self._word_num_grams: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = dict()  # bigram -> [(word_id, count), ...]
+
+        # list of fields per hawker, each field is a list of word ids
+        self._fields: List[List[List[int]]] = []
+        for hawker in self.hawkers:
+            self._fields.append([[self._add_word(word) for word in words] for words in hawker.text_fields])
+
+    def _add_word(self, word: str) -> int:
+        if word not in self._word_ids:
+            word_id = self._word_ids[word] = len(self._word_num_grams)
+            bigrams = _bigram_counts(word)
+            self._word_num_grams.append(sum(bigrams.values()))
+            for bigram, count in bigrams.items():
+                self._postings.setdefault(bigram, []).append((word_id, count))
+        return self._word_ids[word]
+
+    def upper_bounds(self, query_words: Sequence[str]) -> Dict[int, float]:
+        """
+        for every hawker (by index) sharing any bigram with the (tokenized) query,
+        an upper bound on the first value (i.e. the max) returned by `Hawker.words_similarity`
+        """
+        # word-to-word upper bound, only for words that share at least one bigram
+        word_bounds: Dict[str, Dict[int, float]] = dict()
+        for query_word in set(query_words):
+            bigrams = _bigram_counts(query_word)
+            num_grams = sum(bigrams.values())
+            overlaps: Dict[int, int] = dict()
+            for bigram, count in bigrams.items():
+                for word_id, word_count in self._postings.get(bigram, []):
+                    overlaps[word_id] = overlaps.get(word_id, 0) + 2 * min(count, word_count)
+            word_bounds[query_word] = {word_id: min(1.0, overlap / (num_grams + self._word_num_grams[word_id]))
+                                       for word_id, overlap in overlaps.items()}
+
+        # the optimal assignment can't do better than every query word taking its best match
+        touched_word_ids: Set[int] = set()
+        for bounds in word_bounds.values():
+            touched_word_ids.update(bounds)
+
+        out = dict()
+        for idx, fields in enumerate(self._fields):
+            best = 0.0
+            for field_word_ids in fields:
+                if touched_word_ids.isdisjoint(field_word_ids):
+                    continue
+                matches = sorted((max(word_bounds[query_word].get(word_id, 0.0) for word_id in field_word_ids)
+                                  for query_word in query_words), reverse=True)
+                best = max(best, sum(matches[:len(field_word_ids)]))
+            if best > 0:
+                out[idx] = best
+        return out
+
+    def search(self,
+               text: str,
+               threshold: float = 0.0,
+               limit: Optional[int] = None,
+               ) -> List[Tuple[Hawker, Tuple[float, float]]]:
+        """
+        same results as sorting every hawker by `Hawker.text_similarity` and keeping those above the threshold
+        (and then keeping only the top `limit` results), but only scores the hawkers that could make the cut
+        """
+        query_words = tokenize(text)
+        results = []
+        kth_best = None
+        for idx, upper_bound in sorted(self.upper_bounds(query_words).items(), key=lambda x: x[1], reverse=True):
+            # nothing else can pass the threshold, or beat the results we already have
+            if upper_bound + _BOUND_SLACK < threshold:
+                break
+            if kth_best is not None and upper_bound + _BOUND_SLACK < kth_best:
+                break
+
+            score = self.hawkers[idx].words_similarity(query_words)
+            if score > (threshold, 0):
+                results.append((idx, score))
+                if limit is not None and len(results) >= limit:
+                    kth_best = sorted((score[0] for _, score in results), reverse=True)[limit - 1]
+
+        # break ties in the original order, like a stable sort over the whole list would
+        results = sorted(sorted(results), key=lambda x: x[1], reverse=True)[:limit]
+        return [(self.hawkers[idx], score) for idx, score in results]
+
+
 if __name__ == '__main__':
     hawkers = []
     df = pd.read_csv('data/hawker-centres/hawker-centres.csv')
@@ -370,3 +724,47 @@ if __name__ == '__main__':
     print(tmp[3].text_similarity(query), tmp[3])
     print(tmp[4].text_similarity(query), tmp[4])
     print(tmp[5].text_similarity(query), tmp[5])
+
+    # per-query cpu time, re-tokenizing every field vs using the pre-tokenized fields
+    print()
+    queries = ['west coast', 'clementi', 'ang mo kio ave 10', 'bedok interchange', 'old airport road', 'maxwel']
+
+    t = time.process_time()
+    for query in queries:
+        for hawker in hawkers:
+            _scores = [text_similarity(query, self_text)
+                       for self_text in [hawker.name, hawker.address_myenv, hawker.addressbuildingname]
+                       if self_text is not None]
+    print('re-tokenized', (time.process_time() - t) / len(queries))
+
+    t = time.process_time()
+    for query in queries:
+        query_words = tokenize(query)
+        for hawker in hawkers:
+            hawker.words_similarity(query_words)
+    print('pre-tokenized', (time.process_time() - t) / len(queries))
+
+    t = time.process_time()
+    index = HawkerTextIndex(hawkers)
+    print('build index', time.process_time() - t)
+
+    t = time.process_time()
+    for query in queries:
+        index.search(query, threshold=0.6, limit=25)
+    print('pre-tokenized and indexed', (time.process_time() - t) / len(queries))
+
+    # the pruned search must return exactly what scoring every hawker would
+    check_queries = sorted({word for hawker in hawkers for words in hawker.text_fields for word in words})
+    check_queries += [' '.join(words) for hawker in hawkers for words in hawker.text_fields]
+    n_mismatches = 0
+    for query in check_queries:
+        query_words = tokenize(query)
+        scores = [(hawker, hawker.words_similarity(query_words)) for hawker in hawkers]
+        for threshold, limit in [(0.0, 5), (0.6, 25), (0.6, None)]:
+            expected = sorted([(hawker, score) for hawker, score in scores if score > (threshold, 0)],
+                              key=lambda x: x[1], reverse=True)[:limit]
+            if index.search(query, threshold=threshold, limit=limit) != expected:
+                n_mismatches += 1
+                print('mismatch', repr(query), threshold, limit)
+    print('checked', len(check_queries), 'queries against brute force, mismatches:', n_mismatches)
+    assert n_mismatches == 0
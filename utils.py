@@ -1,23 +1,43 @@
 import datetime
 import logging
+import os
+import pickle
 import re
 import sys
 from functools import lru_cache
 from pathlib import Path
+from typing import Dict
+from typing import List
 from typing import Optional
 from typing import Tuple
 
 import pandas as pd
 import requests
 
+from api_wrappers import svy21
+from api_wrappers import transport
 from api_wrappers.data_gov_sg_v2.data_api import get_dataset_df
+from api_wrappers.gazetteer import postal_codes
 from api_wrappers.location import Location
+from api_wrappers.location import LocationIndex
+from api_wrappers.onemap_sg_v2 import OneMapResult
+from api_wrappers.polygons import PolygonRegions
 from config import SECRETS
+from hawker_set import HawkerSet
 from hawkers import Hawker
+from hawkers import closure_periods_from_dataframe
+from hawkers import normalize_hawker_center_name
 
 # too lazy to write code, using global var instead
 last_loaded_date = datetime.datetime(1970, 1, 1)
 
+# bump this whenever Hawker or HawkerSet (or anything inside them) changes, so that old snapshots are ignored
+SNAPSHOT_VERSION = 5
+SNAPSHOT_PATH = Path('data/hawker-data-snapshot.pickle')
+
+# bundled, run `python download-planning-areas.py` to (re-)download it from onemap
+PLANNING_AREAS_PATH = Path('data/planning-areas/planning-areas.geojson')
+
 DATASET_IDS = {
     'Dates of Hawker Centres Closure':
         'd_bda4baa634dd1cc7a6c7cad5f19e2d68',  # CSV
@@ -90,22 +110,58 @@ def setup_logging(app_name) -> logging.Logger:
     return logging.getLogger()
 
 
-def normalize_hawker_center_name(name):
-    name = f' {name.casefold()} '
-    name = name.replace('&', ' and ')
-    name = name.replace('@', ' at ')
-    name = name.replace(' the ', ' ')
-    return ' '.join(name.split())
-
-
-def load_hawker_data(csv_path: Optional[str] = None):
+class HawkerMatcher:
+    """
+    indexed join from rows of other datasets to hawkers, built once per load
+    returns the same match as checking every hawker in order for (in order of priority):
+    * name exact matched (after normalizing)
+    * geoloc within 1 meter
+    * geoloc within 1 meter (alternative latlong)
+    * address exact matched
+    """
+
+    def __init__(self, hawkers: List[Hawker], max_distance: float = 1):
+        self.hawkers = hawkers
+        self.max_distance = max_distance
+
+        # only the first hawker for each key can ever be matched
+        self._by_name: Dict[str, int] = dict()
+        self._by_address: Dict[str, int] = dict()
+        for idx, hawker in enumerate(hawkers):
+            self._by_name.setdefault(normalize_hawker_center_name(hawker.name), idx)
+            if hawker.address_myenv is not None:
+                self._by_address.setdefault(hawker.address_myenv, idx)
+
+        self._locations = LocationIndex(hawkers)
+        self._locations_hc_idxs = [idx for idx, hawker in enumerate(hawkers) if hawker.location_hc]
+        self._locations_hc = LocationIndex(hawkers[idx].location_hc for idx in self._locations_hc_idxs)
+
+    def match(self, name: str, location: Location, address: Optional[str]) -> Tuple[Optional[Hawker], Optional[str]]:
+        """
+        :return: (matched hawker, reason), or (None, None) if nothing matched
+        """
+        matches = []  # (hawker idx, reason priority, reason)
+        if normalize_hawker_center_name(name) in self._by_name:
+            matches.append((self._by_name[normalize_hawker_center_name(name)], 0, 'name'))
+        for idx in self._locations.within_radius_idxs(location, self.max_distance):
+            matches.append((idx, 1, 'location'))
+        for idx in self._locations_hc.within_radius_idxs(location, self.max_distance):
+            matches.append((self._locations_hc_idxs[idx], 2, 'location_hc'))
+        if address in self._by_address:
+            matches.append((self._by_address[address], 3, 'address'))
+
+        if not matches:
+            return None, None
+        idx, _, matched_by = min(matches)
+        return self.hawkers[idx], matched_by
+
+
+def load_hawker_data(csv_path: Optional[str] = None) -> HawkerSet:
     # healthcheck start
-    requests.get(SECRETS['healthcheck_url'] + '/start', verify=False)
+    transport.get(SECRETS['healthcheck_url'] + '/start')
 
-    hawkers = []
     df = pd.read_csv('data/hawker-centres/hawker-centres.csv')
-    for i, row in df.iterrows():
-        hawkers.append(Hawker.from_row(row))
+    hawkers = Hawker.from_dataframe(df)
 
     # # filter to useful hawker centers
     # hawkers = [hawker for hawker in hawkers if hawker.no_of_food_stalls > 0]
@@ -118,40 +174,118 @@ def load_hawker_data(csv_path: Optional[str] = None):
         global last_loaded_date
         _, last_loaded_date, df = get_dataset_df(DATASET_IDS['Dates of Hawker Centres Closure'])
 
-    for i, row in df.iterrows():
-        row_location = Location(float(row['latitude_hc']), float(row['longitude_hc']))
-        for hawker in hawkers:
-            # name exact matched
-            if normalize_hawker_center_name(hawker.name) == normalize_hawker_center_name(row['name']):
-                hawker.add_cleaning_periods(row)
-                break
-
-            # geoloc within 1 meter
-            elif hawker.distance(row_location) <= 1:
-                logging.info(f'matched by location: {hawker.name}, {row["name"]}')
-                hawker.add_cleaning_periods(row)
-                break
-
-            # geoloc within 1 meter (alternative latlong)
-            elif hawker.location_hc and hawker.location_hc.distance(row_location) <= 1:
-                logging.info(f'matched by location_hc: {hawker.name}, {row["name"]}')
-                hawker.add_cleaning_periods(row)
-                break
-
-            # address exact matched
-            elif hawker.address_myenv == row['address_myenv']:
-                logging.info(f'matched by address: {hawker.name}, {row["name"]}')
-                hawker.add_cleaning_periods(row)
-                break
+    matcher = HawkerMatcher(hawkers)
+    for name, latitude, longitude, address, (cleaning_date_ranges, other_works_period) in zip(
+            df['name'].tolist(),
+            pd.to_numeric(df['latitude_hc']).astype(float).tolist(),
+            pd.to_numeric(df['longitude_hc']).astype(float).tolist(),
+            df['address_myenv'].tolist(),
+            closure_periods_from_dataframe(df)):
+        hawker, matched_by = matcher.match(name, Location(latitude, longitude), address)
 
         # no matched
-        else:
-            logging.warning(f'could not find {row["name"]}')
+        if hawker is None:
+            logging.warning(f'could not find {name}')
+            continue
+
+        # name exact matched is the expected case, so it's not logged
+        if matched_by != 'name':
+            logging.info(f'matched by {matched_by}: {hawker.name}, {name}')
+        hawker.add_closures(cleaning_date_ranges, other_works_period)
+
+    hawker_set = HawkerSet(hawkers, planning_areas=load_planning_areas())
+    add_hawkers_to_gazetteer(hawkers)
+
+    # only snapshot the live dataset, not historical csv files
+    if csv_path is None:
+        save_hawker_snapshot(hawker_set)
 
     # healthcheck success
-    requests.get(SECRETS['healthcheck_url'], verify=False)
+    transport.get(SECRETS['healthcheck_url'])
     logging.info(f'updated {len(hawkers)} hawker center details')
-    return hawkers
+    return hawker_set
+
+
+def add_hawkers_to_gazetteer(hawkers: List[Hawker]):
+    """
+    the bundled hawker centre addresses are the seed corpus for the gazetteer (and its full-text search),
+    so e.g. `/near tiong bahru market` can be answered without calling onemap
+    the building name comes from the address (not the hawker centre's name), so it's what onemap would have said
+    postal codes that onemap has already told us about are left as they are
+    """
+    hawkers = [hawker for hawker in hawkers
+               if hawker.addresspostalcode is not None and hawker.addressstreetname is not None]
+    xs, ys = svy21.wgs84_to_svy21([hawker.latitude for hawker in hawkers], [hawker.longitude for hawker in hawkers])
+    n_added = postal_codes.add_many(OneMapResult(block_no=hawker.addressblockhousenumber or '',
+                                                 road_name=hawker.addressstreetname.upper(),
+                                                 # same as onemap, which says NIL when there's no building name
+                                                 building_name=(hawker.addressbuildingname or '').strip().upper() or 'NIL',
+                                                 zipcode=f'{hawker.addresspostalcode:06d}',
+                                                 latitude=hawker.latitude,
+                                                 longitude=hawker.longitude,
+                                                 svy21_x=float(x),
+                                                 svy21_y=float(y),
+                                                 ) for hawker, x, y in zip(hawkers, xs, ys))
+    logging.debug(f'added {n_added} hawker centers to the gazetteer')
+
+
+def load_planning_areas(path: Path = PLANNING_AREAS_PATH) -> Optional[PolygonRegions]:
+    """
+    URA master plan 2019 planning areas, from the bundled geojson file (this never calls onemap)
+    returns None if the file is missing, in which case planning area lookups won't find anything
+    """
+    if not path.exists():
+        logging.warning(f'planning areas not found at {path}, run `python download-planning-areas.py`')
+        return None
+
+    return _read_planning_areas(path)
+
+
+@lru_cache(maxsize=1)
+def _read_planning_areas(path: Path) -> PolygonRegions:
+    return PolygonRegions.from_geojson(path, 'PLN_AREA_N')
+
+
+def save_hawker_snapshot(hawker_set: HawkerSet, path: Path = SNAPSHOT_PATH):
+    """
+    pickle the fully joined and indexed hawker data, so the next startup doesn't need to wait for the upstream apis
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f'{path.name}.partial')
+    with temp_path.open('wb') as f:
+        pickle.dump({'version':          SNAPSHOT_VERSION,
+                     'last_loaded_date': last_loaded_date,
+                     'hawker_set':       hawker_set,
+                     }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)  # atomic, so a crash mid-write can't leave a broken snapshot
+    logging.info(f'saved snapshot of {len(hawker_set)} hawker centers to {path}')
+
+
+def load_hawker_snapshot(path: Path = SNAPSHOT_PATH) -> Optional[HawkerSet]:
+    """
+    load the snapshot written by the last successful `load_hawker_data`
+    returns None if there is no usable snapshot, in which case call `load_hawker_data` instead
+    """
+    if not path.exists():
+        logging.info(f'no snapshot found at {path}')
+        return None
+
+    # noinspection PyBroadException
+    try:
+        with path.open('rb') as f:
+            snapshot = pickle.load(f)
+    except Exception:
+        logging.exception(f'failed to load snapshot from {path}')
+        return None
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        logging.info(f'ignoring outdated snapshot at {path}')
+        return None
+
+    global last_loaded_date
+    last_loaded_date = snapshot['last_loaded_date']
+    logging.info(f'loaded snapshot of {len(snapshot["hawker_set"])} hawker centers from {path}')
+    return snapshot['hawker_set']
 
 
 RE_COMMAND = re.compile(r'(?P<command>[/\\][a-zA-Z0-9_]{1,64})(?![a-zA-Z0-9_])')